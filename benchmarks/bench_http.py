@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""
+End-to-end benchmark of `/metrics`. Starts the stub Patroni and the exporter
+in separate processes and reports the throughput and latency percentiles
+of concurrent scrapes for each exporter configuration
+"""
+import http.client
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Dict, List, Tuple
+
+from common import BENCHMARKS_DIR, parse_args, report
+
+EXPORTER = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'patroni_exporter.py')
+STUB = os.path.join(BENCHMARKS_DIR, 'stub_patroni.py')
+
+SCENARIOS = {
+    'default': '',
+    'threads': '--threads 8',
+    'cache': '--threads 8 --cache-ttl 1 --cache-stale 5',
+    'poll': '--threads 8 --poll-interval 1',
+    'asyncio': '--engine asyncio',
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(port: int, path: str = '/', timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                    timeout=1)
+            connection.request('GET', path)
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def scrape(port: int, path: str, requests: int, concurrency: int) \
+        -> Tuple[float, List[float], int]:
+    """
+    Scrape the exporter by concurrent keep-alive clients
+    :return: duration, latencies of the successful scrapes, failed scrapes
+    """
+    latencies, errors = [], []
+    per_client = max(requests // concurrency, 1)
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        for _ in range(per_client):
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    raise OSError(response.status)
+                latencies.append(time.perf_counter() - started)
+            except (OSError, http.client.HTTPException):
+                errors.append(1)
+                connection.close()
+        connection.close()
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    return time.perf_counter() - started, latencies, len(errors)
+
+
+def run_scenario(name: str, exporter_args: str, args) -> Dict:
+    stub_port, exporter_port = free_port(), free_port()
+    stub = subprocess.Popen([sys.executable, STUB, '--port', str(stub_port),
+                             '--payload', args.payload,
+                             '--latency', str(args.latency),
+                             '--error-rate', str(args.error_rate)])
+    exporter = subprocess.Popen(
+        [sys.executable, EXPORTER, '--port', str(exporter_port),
+         '--bind', '127.0.0.1',
+         '--patroni-url', f'http://127.0.0.1:{stub_port}/patroni',
+         *shlex.split(exporter_args)],
+        stderr=subprocess.DEVNULL)
+    try:
+        wait_for(stub_port)
+        wait_for(exporter_port, '/health')
+        # warm up
+        scrape(exporter_port, '/metrics', args.concurrency, args.concurrency)
+        duration, latencies, errors = scrape(exporter_port, '/metrics',
+                                             args.requests, args.concurrency)
+    finally:
+        exporter.terminate()
+        stub.terminate()
+        exporter.wait()
+        stub.wait()
+
+    return {
+        'benchmark': 'metrics',
+        'scenario': name,
+        'exporter_args': exporter_args,
+        'payload': args.payload,
+        'upstream_latency': args.latency,
+        'upstream_error_rate': args.error_rate,
+        'concurrency': args.concurrency,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'requests_per_second': len(latencies) / duration,
+        'latency_p50': percentile(latencies, 0.50) if latencies else None,
+        'latency_p90': percentile(latencies, 0.90) if latencies else None,
+        'latency_p99': percentile(latencies, 0.99) if latencies else None,
+        'latency_max': max(latencies) if latencies else None,
+    }
+
+
+def main() -> None:
+    parser = parse_args(__doc__)
+    parser.add_argument('--scenario', action='append',
+                        help='Exporter configuration to benchmark as '
+                             '`name=arguments` or a name of a predefined '
+                             f'one: {", ".join(SCENARIOS)}. '
+                             f'All predefined ones by default')
+    parser.add_argument('--payload', default='primary',
+                        help='Recorded payload served by the stub Patroni')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='Latency of the stub Patroni in seconds')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of failing requests to the stub')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=4)
+    args = parser.parse_args()
+
+    scenarios = {}
+    for scenario in args.scenario or SCENARIOS:
+        name, _, exporter_args = scenario.partition('=')
+        scenarios[name] = exporter_args if _ else SCENARIOS[name]
+
+    results = [run_scenario(name, exporter_args, args)
+               for name, exporter_args in scenarios.items()]
+    report('http', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+"""
+Compares the JSON decoders available to the exporter
+on the recorded responses of the Patroni API
+"""
+from importlib import import_module
+
+from common import load_payloads, measure, parse_args, report
+
+from requests import Response
+
+from patroni_exporter import JSON_DECODERS
+
+
+def requests_json(body: bytes):
+    """
+    Decoding by `Response.json()` as done by the exporter before
+    """
+    r = Response()
+    r._content = body
+    return r.json()
+
+
+def main() -> None:
+    args = parse_args(__doc__).parse_args()
+
+    results = []
+    for payload, body in load_payloads().items():
+        decoders = {name: import_module(name).loads for name in JSON_DECODERS}
+        decoders['requests'] = requests_json
+        for decoder, decode in decoders.items():
+            results.append({
+                'benchmark': 'decode',
+                'payload': payload,
+                'decoder': decoder,
+                'bytes': len(body),
+                **measure(lambda: decode(body)),
+            })
+    report('json', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""
+Micro-benchmarks of the stages of the exporter
+processing the recorded Patroni responses
+"""
+import json
+import logging
+
+from common import load_payloads, measure, parse_args, report
+
+from patroni_exporter import PatroniCollector, logger
+
+
+def collector_for(payload: str, body: bytes) -> PatroniCollector:
+    mode = 'cluster' if payload == 'cluster' else 'node'
+    collector = PatroniCollector(f'http://127.0.0.1/{payload}', 5, 'true',
+                                 mode=mode)
+    collector.load_scrape(200, json.loads(body))
+    return collector
+
+
+def main() -> None:
+    args = parse_args(__doc__).parse_args()
+    # not all keys of the recorded payloads are exported
+    logger.setLevel(logging.ERROR)
+
+    timestamp = '2024-01-12 14:02:11.374201+00:00'
+    results = [
+        {'benchmark': 'to_timestamp', 'memoized': True,
+         **measure(lambda: PatroniCollector.to_timestamp(timestamp))},
+        {'benchmark': 'to_timestamp', 'memoized': False,
+         **measure(lambda: PatroniCollector.to_timestamp.__wrapped__(
+             timestamp))},
+    ]
+
+    for payload, body in load_payloads().items():
+        collector = collector_for(payload, body)
+        results.append({'benchmark': 'preprocessing', 'payload': payload,
+                        **measure(collector.preprocessing)})
+        collector.preprocessing()
+        results.append({'benchmark': 'process_data', 'payload': payload,
+                        'reused': True, **measure(collector.process_data)})
+
+        def process_data():
+            # builds all the families again as if all the data had changed
+            collector._families.clear()
+            collector.process_data()
+
+        results.append({'benchmark': 'process_data', 'payload': payload,
+                        'reused': False, **measure(process_data)})
+
+        def pipeline():
+            collector.load_scrape(200, collector.decode(body))
+            collector.preprocessing()
+            collector.process_data()
+
+        results.append({'benchmark': 'decode_to_metrics', 'payload': payload,
+                        **measure(pipeline)})
+
+    report('pipeline', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+Startup benchmark of the exporter. Measures the time of `--help`,
+of importing the module, from spawning the exporter to its first
+successful scrape of the stub Patroni, and the resident memory
+of the exporter after that scrape
+"""
+import http.client
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from bench_http import EXPORTER, STUB, free_port, wait_for
+from common import BENCHMARKS_DIR, parse_args, report
+
+
+def run(command: List[str]) -> float:
+    started = time.perf_counter()
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def resident_memory(pid: int) -> int:
+    """
+    Resident memory of a process in bytes, read from `/proc`
+    """
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) * 1024
+    raise ValueError(f'VmRSS of {pid} not found')
+
+
+def first_scrape(stub_port: int, exporter_args: List[str]) -> Dict:
+    """
+    Spawn the exporter and scrape it until it succeeds
+    :return: time to the first successful scrape and the memory after it
+    """
+    port = free_port()
+    started = time.perf_counter()
+    exporter = subprocess.Popen(
+        [sys.executable, EXPORTER, '--port', str(port), '--bind', '127.0.0.1',
+         '--patroni-url', f'http://127.0.0.1:{stub_port}/patroni',
+         *exporter_args],
+        stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                connection = http.client.HTTPConnection('127.0.0.1', port,
+                                                        timeout=5)
+                connection.request('GET', '/metrics')
+                status = connection.getresponse().status
+                connection.close()
+                if status == 200:
+                    break
+            except OSError:
+                pass
+            if exporter.poll() is not None:
+                raise RuntimeError('the exporter has exited')
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - started
+        return {'seconds': elapsed, 'rss': resident_memory(exporter.pid)}
+    finally:
+        exporter.terminate()
+        exporter.wait()
+
+
+def main() -> None:
+    parser = parse_args(__doc__)
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Number of the measurements, the median counts')
+    parser.add_argument('--engine', choices=('wsgi', 'asyncio'),
+                        default='wsgi')
+    args = parser.parse_args()
+
+    help_times = [run([sys.executable, EXPORTER, '--help'])
+                  for _ in range(args.repeat)]
+    import_times = [run([sys.executable, '-c', 'import patroni_exporter'])
+                    for _ in range(args.repeat)]
+    # the time of the interpreter itself to tell it apart
+    bare_times = [run([sys.executable, '-c', 'pass'])
+                  for _ in range(args.repeat)]
+
+    stub_port = free_port()
+    stub = subprocess.Popen([sys.executable, STUB, '--port', str(stub_port)])
+    try:
+        wait_for(stub_port)
+        scrapes = [first_scrape(stub_port, ['--engine', args.engine])
+                   for _ in range(args.repeat)]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    common = {'engine': args.engine, 'repeat': args.repeat}
+    report('startup', [
+        {'benchmark': 'interpreter',
+         'seconds': statistics.median(bare_times), **common},
+        {'benchmark': 'help',
+         'seconds': statistics.median(help_times), **common},
+        {'benchmark': 'import',
+         'seconds': statistics.median(import_times), **common},
+        {'benchmark': 'first_scrape',
+         'seconds': statistics.median(s['seconds'] for s in scrapes),
+         'rss_bytes': statistics.median(s['rss'] for s in scrapes),
+         **common},
+    ], args.output)
+
+
+if __name__ == '__main__':
+    # `import patroni_exporter` is run from the root of the checkout
+    os.chdir(os.path.dirname(BENCHMARKS_DIR))
+    main()
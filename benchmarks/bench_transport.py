@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Benchmark of the transports of the Patroni client. Fetches the response
+of the stub Patroni by the requests library and by the lightweight
+HTTP/1.1 client of `--transport=http`, over TCP on loopback and over
+a unix socket, and reports the latency and the CPU time of the exporter
+per request
+"""
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict
+from urllib.parse import quote
+
+from bench_http import STUB, free_port, percentile, wait_for
+from common import parse_args, report
+
+from patroni_exporter import PatroniCollector
+
+
+def wait_for_socket(path: str, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX) as s:
+                s.connect(path)
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def run(transport: str, url: str, requests: int) -> Dict:
+    collector = PatroniCollector(url, 5, 'true', transport=transport)
+    # the connection is set up and kept alive
+    for _ in range(10):
+        collector.fetch()
+
+    latencies = []
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for _ in range(requests):
+        request_started = time.perf_counter()
+        status_code, _ = collector.fetch()
+        latencies.append(time.perf_counter() - request_started)
+        assert status_code == 200, status_code
+    duration = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    return {
+        'benchmark': 'transport',
+        'transport': transport,
+        'socket': 'unix' if url.startswith('http+unix') else 'tcp',
+        'requests': requests,
+        'requests_per_second': requests / duration,
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p99': percentile(latencies, 0.99),
+        'cpu_seconds_per_request': cpu / requests,
+    }
+
+
+def main() -> None:
+    parser = parse_args(__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub_socket = os.path.join(tempfile.mkdtemp(), 'patroni.sock')
+    stubs = [
+        subprocess.Popen([sys.executable, STUB, '--port', str(stub_port)]),
+        subprocess.Popen([sys.executable, STUB,
+                          '--unix-socket', stub_socket]),
+    ]
+    tcp_url = f'http://127.0.0.1:{stub_port}/patroni'
+    unix_url = f'http+unix://{quote(stub_socket, safe="")}/patroni'
+    try:
+        wait_for(stub_port)
+        wait_for_socket(stub_socket)
+        results = [
+            run('requests', tcp_url, args.requests),
+            run('http', tcp_url, args.requests),
+            run('http', unix_url, args.requests),
+        ]
+    finally:
+        for stub in stubs:
+            stub.terminate()
+            stub.wait()
+        shutil.rmtree(os.path.dirname(stub_socket), ignore_errors=True)
+
+    report('transport', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
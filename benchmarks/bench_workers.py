@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+"""
+Scaling benchmark of `--workers`. Starts the stub Patroni and the exporter
+with an increasing number of worker processes and reports the throughput
+of `/metrics` scraped by clients running in several processes, so that
+the clients are not limited by the GIL of a single process
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from bench_http import EXPORTER, STUB, free_port, percentile, scrape, wait_for
+from common import parse_args, report
+
+
+def client(port: int, requests: int, concurrency: int) \
+        -> Tuple[float, List[float], int]:
+    return scrape(port, '/metrics', requests, concurrency)
+
+
+def run_workers(workers: int, stub_port: int, args) -> Dict:
+    port = free_port()
+    exporter = subprocess.Popen(
+        [sys.executable, EXPORTER, '--port', str(port), '--bind', '127.0.0.1',
+         '--patroni-url', f'http://127.0.0.1:{stub_port}/patroni',
+         '--workers', str(workers), '--poll-interval', '1',
+         '--threads', str(args.threads)],
+        stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port, '/health')
+        with multiprocessing.Pool(args.clients) as pool:
+            load = [(port, args.requests // args.clients, args.concurrency)
+                    for _ in range(args.clients)]
+            # warm up every worker
+            pool.starmap(client, [(port, args.concurrency, args.concurrency)
+                                  for _ in range(args.clients)])
+            results = pool.starmap(client, load)
+    finally:
+        exporter.terminate()
+        exporter.wait()
+
+    latencies = [latency for _, l, _ in results for latency in l]
+    errors = sum(e for _, _, e in results)
+    duration = max(d for d, _, _ in results)
+    return {
+        'benchmark': 'workers',
+        'workers': workers,
+        'threads': args.threads,
+        'clients': args.clients,
+        'concurrency': args.concurrency,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'requests_per_second': len(latencies) / duration,
+        'latency_p50': percentile(latencies, 0.50) if latencies else None,
+        'latency_p99': percentile(latencies, 0.99) if latencies else None,
+    }
+
+
+def main() -> None:
+    cpus = os.cpu_count() or 1
+    parser = parse_args(__doc__)
+    parser.add_argument('--workers', type=int, action='append',
+                        help='Number of workers to benchmark, may be given '
+                             'more times. Powers of two up to the number '
+                             'of CPUs by default')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='`--threads` of every worker')
+    parser.add_argument('--clients', type=int, default=cpus,
+                        help='Number of the client processes')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Connections of every client process')
+    parser.add_argument('--requests', type=int, default=4000)
+    args = parser.parse_args()
+
+    workers = args.workers or [2 ** i for i in range(cpus.bit_length())
+                               if 2 ** i <= cpus]
+    stub_port = free_port()
+    stub = subprocess.Popen([sys.executable, STUB, '--port', str(stub_port)])
+    try:
+        wait_for(stub_port)
+        results = [run_workers(n, stub_port, args) for n in workers]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    # throughput of N workers relative to N times the one of the first run
+    base = results[0]['requests_per_second'] / results[0]['workers']
+    for result in results:
+        result['cpus'] = cpus
+        result['scaling_efficiency'] = \
+            result['requests_per_second'] / (base * result['workers'])
+    report('workers', results, args.output)
+
+
+if __name__ == '__main__':
+    main()
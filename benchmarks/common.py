@@ -0,0 +1,85 @@
+"""
+Helpers shared by the benchmarks of patroni-exporter.
+Every benchmark prints a JSON document with its results, so they
+can be stored and compared across versions of the exporter
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from typing import Any, Callable, Dict, List, Optional
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PAYLOADS_DIR = os.path.join(BENCHMARKS_DIR, 'payloads')
+
+# make the exporter importable when run from a checkout
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+
+def load_payloads() -> Dict[str, bytes]:
+    """
+    Load the recorded responses of the Patroni API
+    :return: raw bodies by the name of the payload
+    """
+    payloads = {}
+    for filename in sorted(os.listdir(PAYLOADS_DIR)):
+        name, ext = os.path.splitext(filename)
+        if ext == '.json':
+            with open(os.path.join(PAYLOADS_DIR, filename), 'rb') as f:
+                payloads[name] = f.read().strip()
+    return payloads
+
+
+def measure(func: Callable[[], Any], repeat: int = 5,
+            number: Optional[int] = None) -> Dict[str, float]:
+    """
+    Time a function by `timeit`
+    :param func:
+    :param repeat: number of the timed rounds, the best one counts
+    :param number: calls per round, by default enough to take 0.2s
+    :return:
+    """
+    timer = timeit.Timer(func)
+    if not number:
+        number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {
+        'calls': number * repeat,
+        'seconds_per_call': best,
+        'calls_per_second': 1 / best if best else float('inf'),
+    }
+
+
+def parse_args(description: str) -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('-o', '--output',
+                        help='Write the results to the file '
+                             'instead of the standard output')
+    return parser
+
+
+def report(suite: str, results: List[Dict[str, Any]],
+           output: Optional[str] = None) -> None:
+    """
+    Print the results of a benchmark suite as JSON
+    :param suite: name of the suite
+    :param results: one dict per benchmark
+    :param output: file to write the results to
+    :return:
+    """
+    import patroni_exporter
+
+    document = json.dumps({
+        'suite': suite,
+        'exporter_version': patroni_exporter.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
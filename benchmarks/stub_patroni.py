@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Stub of the Patroni REST API replaying the recorded payloads.
+`/patroni` serves the payload chosen by `--payload`, `/cluster` the cluster
+payload and `/<name>` any recorded payload. Replicas respond with 503
+like Patroni does. Latency and errors can be injected
+"""
+import argparse
+import os
+import random
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import TCPServer, ThreadingMixIn
+from typing import Dict, Optional, Tuple, Union
+
+from common import load_payloads
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Union[Tuple[str, int], str],
+                 payloads: Dict[str, bytes],
+                 payload: str, latency: float, error_rate: float):
+        super().__init__(address, StubHandler)
+        self.payloads = payloads
+        self.payload = payload
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+
+
+class UnixStubServer(StubServer):
+    """
+    Stub listening at a unix socket, like a local proxy of Patroni would
+    """
+    address_family = socket.AF_UNIX
+
+    def server_bind(self) -> None:
+        # `HTTPServer.server_bind()` expects a host and a port
+        TCPServer.server_bind(self)
+        self.server_name, self.server_port = 'localhost', 0
+
+    def server_close(self) -> None:
+        super().server_close()
+        os.unlink(self.server_address)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:
+        server = self.server
+        server.requests += 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        if random.random() < server.error_rate:
+            # alternate between an error response and a dropped connection
+            if random.random() < 0.5:
+                self.respond(500, b'{"error": "injected"}')
+            else:
+                self.close_connection = True
+            return
+
+        name = self.path.strip('/').split('?')[0] or 'patroni'
+        name = {'patroni': server.payload}.get(name, name)
+        body = server.payloads.get(name)
+        if body is None:
+            self.respond(404, b'{}')
+        elif name == 'replica':
+            self.respond(503, body)
+        else:
+            self.respond(200, body)
+
+    def respond(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        # one write for the headers and the body, so that the response
+        # is not delayed by Nagle's algorithm on kept-alive connections
+        self._headers_buffer.append(b'\r\n' + body)
+        self.flush_headers()
+
+    def log_message(self, *args) -> None:
+        pass
+
+
+def start_stub(port: int = 0, payload: str = 'primary', latency: float = 0,
+               error_rate: float = 0,
+               unix_socket: Optional[str] = None) -> StubServer:
+    """
+    Start the stub in a background thread
+    :param unix_socket: path of the unix socket to listen at instead
+                        of the port
+    :return: the server, its port is in `server_address`
+    """
+    if unix_socket:
+        server = UnixStubServer(unix_socket, load_payloads(), payload,
+                                latency, error_rate)
+    else:
+        server = StubServer(('127.0.0.1', port), load_payloads(), payload,
+                            latency, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8008)
+    parser.add_argument('--payload', default='primary',
+                        choices=sorted(load_payloads()),
+                        help='Payload served on `/patroni`')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds to wait before responding')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of requests failing')
+    parser.add_argument('--unix-socket',
+                        help='Listen at the unix socket of the given path '
+                             'instead of the port')
+    args = parser.parse_args()
+
+    if args.unix_socket:
+        server = UnixStubServer(args.unix_socket, load_payloads(),
+                                args.payload, args.latency, args.error_rate)
+    else:
+        server = StubServer(('127.0.0.1', args.port), load_payloads(),
+                            args.payload, args.latency, args.error_rate)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
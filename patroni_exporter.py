@@ -10,30 +10,712 @@ __email__ = 'jan.tomsa@showmax.com'
 __date__ = '2019/03/22'
 __version__ = '0.0.1'
 
-from dateutil.parser import parse
-from collections import defaultdict
-from prometheus_client.core import (
-    InfoMetricFamily, GaugeMetricFamily, REGISTRY
+# Heavy modules (prometheus_client, requests, asyncio, ...) are imported
+# where they are used, so that the exporter starts quickly and does not
+# load what its configuration does not need
+from array import array
+from collections import defaultdict, Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache, partial
+from importlib import import_module
+from importlib.util import find_spec
+from math import isnan, nan
+from typing import (
+    List, Any, Dict, Union, Type, ByteString, Iterable, NamedTuple,
+    Optional, Tuple, Callable, FrozenSet, TYPE_CHECKING
+)
+from urllib.parse import parse_qs, urlparse, unquote
+from wsgiref.simple_server import (
+    make_server, WSGIServer, WSGIRequestHandler, ServerHandler
 )
-from prometheus_client.exposition import choose_encoder
-from typing import List, Any, Dict, Union, Type, ByteString, Iterable
-from urllib.parse import parse_qs, urlparse
-from wsgiref.simple_server import make_server, WSGIServer
 from wsgiref.util import request_uri
 
+import http.client
 import logging
 import argparse
+import copy
+import hashlib
+import mmap
+import re
+import os
+import queue
+import selectors
+import signal
 import socket
-import requests
+import stat
+import struct
+import threading
+import time
+import zlib
 from os import environ
 
+if TYPE_CHECKING:
+    import asyncio
+    import ssl
+    import requests
+    from prometheus_client.core import (
+        GaugeMetricFamily, CounterMetricFamily, Metric
+    )
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('patroni-exporter')
 
+# seconds an idle client connection is kept open
+KEEPALIVE_TIMEOUT = 30
+
+# seconds a client of the thread pool may take to send its request
+# once it has started to, the thread is held meanwhile
+REQUEST_TIMEOUT = 5
+
+# number of `/probe` targets whose collectors are kept between probes
+PROBE_TARGETS = 1024
+# schemes of `/probe` targets, unix sockets of the host are never probed
+PROBE_SCHEMES = ('http', 'https')
+
+# bytes of the memory sharing the last response of Patroni with `--workers`
+SHARED_SCRAPE_SIZE = 1 << 20
+
+# seconds between the checks of `--workers` for a new response of Patroni
+WORKER_CHECK_INTERVAL = 0.05
+
+# number of `--poll-interval`s without a new response of Patroni
+# after which `--workers` report being unhealthy
+WORKER_STALE_POLLS = 3
+
+# seconds a worker waits for the response being written to the shared
+# memory, which only takes longer when the writing process has died
+SHARED_READ_TIMEOUT = 1
+
+# file descriptor of the first socket passed by systemd, see sd_listen_fds(3)
+SD_LISTEN_FDS_START = 3
+
+# scheme of the URLs of Patroni behind a unix socket of a local proxy,
+# e.g. `http+unix://%2Frun%2Fpatroni.sock/patroni`
+UNIX_SCHEME = 'http+unix'
+
+# end of the OpenMetrics exposition
+OPENMETRICS_EOF = b'# EOF\n'
+
+# Patroni API endpoints scraped in the respective modes
+MODE_PATHS = {'node': '/patroni', 'cluster': '/cluster'}
+
+# values here specify which keys from scrape
+# will go to which data sections
+SCRAPE_MAPPINGS = {
+    'node': {
+        'postgresql_info': ('server_version', 'database_system_identifier'),
+        'patroni_info': ('role', 'state'),
+        'postgresql_gauge': ('postmaster_start_time', 'timeline',
+                             'pending_restart'),
+        'patroni_gauge': ('cluster_unlocked', 'pause'),
+    },
+    'cluster': {
+        'cluster_info': ('scope',),
+        'patroni_gauge': ('pause',),
+    },
+}
+
+# these records consist of a dict or a list of dict (replication)
+# and we don't want to put them into a sub-dict,
+# but use them as they are
+DIRECT_MAPPINGS = {
+    'node': {
+        'xlog_gauge': 'xlog',
+        'patroni_info': 'patroni',
+        'replication_info': 'replication',
+    },
+    'cluster': {
+        'cluster_members': 'members',
+    },
+}
+
+# timestamps to convert to unix time
+TIMESTAMP_MAPPINGS = {
+    'node': {
+        'postgresql_gauge': ('postmaster_start_time',),
+        'xlog_gauge': ('replayed_timestamp',),
+    },
+    'cluster': {},
+}
+
+# sections computed from the preprocessed data of another section:
+# (section, source section, name of the method computing it)
+DERIVED_MAPPINGS = {
+    'node': (
+        ('replication_lag_gauge', 'xlog_gauge', '_derive_replication_lag'),
+        ('wal_gauge', 'xlog_gauge', '_derive_wal_rates'),
+    ),
+    'cluster': (
+        ('cluster_members', 'cluster_members', '_derive_member_lag'),
+        ('cluster_members', 'cluster_members', '_derive_member_wal_rates'),
+    ),
+}
+
+# WAL positions whose rates are exported as `<name>_bytes_per_second`
+WAL_RATE_MAPPINGS = {
+    'node': {
+        'location': 'generated',
+        'received_location': 'received',
+        'replayed_location': 'replayed',
+    },
+    'cluster': {
+        'lsn': 'generated',
+        'receive_lsn': 'received',
+        'replay_lsn': 'replayed',
+    },
+}
+
+# sections built from the changes of the node followed across scrapes
+TRACKED_SECTIONS = {
+    'node': ('role_counter', 'timeline_counter',
+             'state_transitions', 'state_gauge'),
+    'cluster': (),
+}
+
+# number of the WAL positions of each member kept to compute the rates
+WAL_HISTORY = 64
+
+# seconds of the WAL positions the rates are computed over
+WAL_RATE_WINDOW = 60
+
+
+def compress_zstd(data: bytes) -> bytes:
+    import zstandard
+    # compressors are not thread-safe, so a new one is used every time
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def compress_gzip(data: bytes) -> bytes:
+    import gzip
+    return gzip.compress(data, compresslevel=6)
+
+
+# supported response encodings in the order of preference
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = OrderedDict()
+if find_spec('zstandard'):
+    COMPRESSORS['zstd'] = compress_zstd
+COMPRESSORS['gzip'] = compress_gzip
+COMPRESSORS['deflate'] = zlib.compress
+# window bits of the zlib streams of the encodings
+ZLIB_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
+
+def compress_prefix(encoding: str, prefix: bytes) -> Callable[[bytes], bytes]:
+    """
+    Compress the beginning shared by many responses once
+    :param encoding: name of the encoding in `COMPRESSORS`
+    :param prefix: beginning of the responses
+    :return: function compressing the whole response given its end
+    """
+    if encoding not in ZLIB_WBITS:
+        # the end follows in a frame of its own
+        compressed = COMPRESSORS[encoding](prefix)
+        return lambda tail: compressed + COMPRESSORS[encoding](tail)
+
+    # the stream is continued by a copy of the compressor for every end
+    compressor = zlib.compressobj(6, zlib.DEFLATED, ZLIB_WBITS[encoding])
+    compressed = compressor.compress(prefix)
+
+    def compress(tail: bytes) -> bytes:
+        stream = compressor.copy()
+        return compressed + stream.compress(tail) + stream.flush()
+    return compress
+
+# installed modules decoding the Patroni responses in the order
+# of preference, the `loads` of all of them accepts the raw bytes
+JSON_DECODERS = tuple(name for name in ('orjson', 'ujson', 'json')
+                      if find_spec(name))
+
+
+class Instrumentation(NamedTuple):
+    """
+    Self-instrumentation of the exporter
+    """
+    stage_duration: Any
+    upstream_errors: Any
+    upstream_response_bytes: Any
+
+
+@lru_cache(maxsize=None)
+def instrumentation() -> Instrumentation:
+    """
+    Create the metrics of the exporter itself on the first use
+    :return:
+    """
+    from prometheus_client import Histogram, Counter as CounterMetric
+
+    stage_duration = Histogram(
+        'patroni_exporter_stage_duration_seconds',
+        'Duration of the stages of getting metrics from Patroni',
+        ['stage'],
+        buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05,
+                 .1, .25, .5, 1, 2.5, 5, 10),
+    )
+    for stage in ('fetch', 'decode', 'preprocess', 'process', 'encode'):
+        stage_duration.labels(stage)
+    return Instrumentation(
+        stage_duration=stage_duration,
+        upstream_errors=CounterMetric(
+            'patroni_exporter_upstream_errors',
+            'Failed requests to the Patroni API by the type of the error',
+            ['type'],
+        ),
+        upstream_response_bytes=CounterMetric(
+            'patroni_exporter_upstream_response_bytes',
+            'Size of the bodies of the responses of the Patroni API',
+        ),
+    )
+
+
+def stage_timer(stage: str) -> Any:
+    """
+    :param stage:
+    :return: context manager timing the given stage
+    """
+    return instrumentation().stage_duration.labels(stage).time()
+
+
+class FamilyTemplate(NamedTuple):
+    """
+    Name, help, type and label names of a metric family exported
+    from the Patroni data, validated once and shared by all snapshots
+    """
+    name: str
+    documentation: str
+    typ: str
+    labels: Tuple[str, ...]
+    # name of the samples, suffixed by `_info` or `_total` by the type
+    sample_name: str
+    # empty family validated by prometheus_client, copied by `family()`
+    prototype: 'Metric'
+    # class of the lazily imported prometheus_client,
+    # importing it in every call would be slower than the rest
+    sample_class: Type[Any]
+
+    def family(self, samples: List[Any]) -> 'Metric':
+        """
+        :param samples: samples of the family built by `sample()`
+        :return: metric family holding the given samples
+        """
+        metric = copy.copy(self.prototype)
+        metric.samples = samples
+        return metric
+
+    def sample(self, label_values: Iterable[str], value: float = 1,
+               info: Optional[Dict[str, str]] = None) -> Any:
+        labels = dict(zip(self.labels, label_values))
+        if info:
+            labels.update(info)
+        return self.sample_class(self.sample_name, labels, value, None)
+
+
+@lru_cache(maxsize=None)
+def family_template(name: str, documentation: str, typ: str,
+                    labels: Tuple[str, ...] = ()) -> FamilyTemplate:
+    """
+    Template of a metric family, created on its first use
+    :param name:
+    :param documentation:
+    :param typ: `gauge`, `counter` or `info`
+    :param labels:
+    :return:
+    """
+    from prometheus_client.core import Metric, Sample
+    # raises on an invalid name or type
+    prototype = Metric(name, documentation, typ)
+    suffix = {'info': '_info', 'counter': '_total'}.get(typ, '')
+    return FamilyTemplate(name, documentation, typ, labels,
+                          f'{name}{suffix}', prototype, Sample)
+
+
+# time format of Patroni, e.g. `2019-03-22 10:11:12.123456+01:00`
+ISO_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:\.(\d{1,6})\d*)?'
+    r'\s*(?:(Z)|([+-])(\d\d):?(\d\d))?$'
+)
+
+# flags Patroni omits when they are not set
+FALSE_DEFAULTS = ('pending_restart', 'cluster_unlocked', 'pause')
+
+# numeric values of cluster members exported as gauges,
+# the rest goes to the member info
+CLUSTER_MEMBER_GAUGES = ('timeline', 'lag', 'lag_bytes',
+                         'wal_generated_bytes_per_second',
+                         'wal_received_bytes_per_second',
+                         'wal_replayed_bytes_per_second',
+                         'wal_catchup_seconds')
+
+# WAL positions of cluster members, which change with every write,
+# so they are only used to compute the lag and not exported as info
+CLUSTER_MEMBER_LSNS = ('lsn', 'receive_lsn', 'replay_lsn')
+
+# roles of the member the others replicate from
+LEADER_ROLES = ('leader', 'master', 'standby_leader')
+
+
+def choose_content_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """
+    Choose the most preferred supported encoding from `Accept-Encoding`
+    :param accept_encoding:
+    :return: name of the encoding or None for no compression
+    """
+    if not accept_encoding:
+        return None
+
+    accepted = set()
+    for coding in accept_encoding.lower().split(','):
+        name, *params = [p.strip() for p in coding.split(';')]
+        try:
+            if any(p.startswith('q=') and float(p[2:]) == 0 for p in params):
+                continue
+        except ValueError:
+            continue
+        accepted.add(name)
+
+    for name in COMPRESSORS:
+        if name in accepted or '*' in accepted:
+            return name
+    return None
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Evaluate `If-None-Match` against the ETag of the current response
+    :param if_none_match:
+    :param etag:
+    :return: whether the client already has the response
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # If-None-Match uses the weak comparison
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    return opaque in (tag.strip()[2:] if tag.strip().startswith('W/')
+                      else tag.strip() for tag in if_none_match.split(','))
+
+
+async def read_headers(reader: 'asyncio.StreamReader') -> Dict[str, str]:
+    """
+    Read HTTP headers up to the empty line terminating them
+    :param reader:
+    :return: headers with lowercased names
+    """
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def read_chunked(reader: 'asyncio.StreamReader') -> bytes:
+    """
+    Read a body sent with chunked transfer encoding
+    :param reader:
+    :return:
+    """
+    chunks = []
+    while True:
+        size = int((await reader.readline()).split(b';')[0], 16)
+        if not size:
+            await read_headers(reader)  # trailers
+            return b''.join(chunks)
+        chunks.append(await reader.readexactly(size))
+        await reader.readline()
+
+
+def systemd_socket() -> Optional[socket.socket]:
+    """
+    Take the listening socket passed by the systemd socket activation
+    :return: None if the exporter has not been started by systemd
+             for a socket
+    """
+    if environ.get('LISTEN_PID') != str(os.getpid()):
+        return None
+    fds = int(environ.get('LISTEN_FDS', 0))
+    # the sockets are not passed on to the child processes
+    for name in ('LISTEN_PID', 'LISTEN_FDS', 'LISTEN_FDNAMES'):
+        environ.pop(name, None)
+    if not fds:
+        return None
+    if fds > 1:
+        logger.warning(f'Listening only at the first of {fds} sockets '
+                       f'passed by systemd')
+    return socket.socket(fileno=SD_LISTEN_FDS_START)
+
+
+def parse_lsn(lsn: Any) -> Optional[int]:
+    """
+    Convert a WAL position to bytes
+    :param lsn: `X/Y` in hex as shown by PostgreSQL or a number of bytes
+    :return: None if it is not known
+    """
+    if isinstance(lsn, int) and not isinstance(lsn, bool):
+        return lsn
+    if isinstance(lsn, str):
+        high, separator, low = lsn.partition('/')
+        try:
+            if separator:
+                return (int(high, 16) << 32) + int(low, 16)
+            return int(lsn)
+        except ValueError:
+            return None
+    return None
+
+
+def sections_cover(built: Optional[FrozenSet[str]],
+                   sections: Optional[FrozenSet[str]]) -> bool:
+    """
+    Whether the built sections include all of the requested ones
+    :param built: None for all sections
+    :param sections: None for all sections
+    :return:
+    """
+    if built is None:
+        return True
+    return sections is not None and sections <= built
+
+
+def restrict_metrics(metrics: 'Iterable[Metric]',
+                     names: Iterable[str]) -> 'Iterable[Metric]':
+    """
+    Keep only the samples of the given names
+    as `restricted_registry()` does
+    :param metrics:
+    :param names:
+    :return: copies of the metrics with some samples of the given names
+    """
+    names = set(names)
+    for metric in metrics:
+        samples = [s for s in metric.samples if s.name in names]
+        if samples:
+            metric = copy.copy(metric)
+            metric.samples = samples
+            yield metric
+
+
+class PlanItem(NamedTuple):
+    """
+    How a key of the Patroni response is preprocessed
+    """
+    section: str
+    # key within the section, None if the value makes the whole section
+    key: Optional[str]
+    convert: Optional[Callable[[Any], Any]]
+
+
+class WalHistory:
+    """
+    Ring buffer of the recent WAL positions of one member. The samples
+    are stored in flat arrays, so they cost no objects once allocated
+    """
+    def __init__(self, series: Iterable[str], capacity: int = WAL_HISTORY):
+        self.columns = {name: column for column, name in enumerate(series)}
+        self.capacity = capacity
+        self.times = array('d', [0.0]) * capacity
+        # row per sample, column per series, NaN when not known
+        self.values = array('d', [nan]) * (capacity * len(self.columns))
+        self.size = 0
+        # row the next sample is written to
+        self.head = 0
+
+    def append(self, when: float, values: Dict[str, Optional[float]]) \
+            -> None:
+        """
+        :param when: monotonic time of the sample
+        :param values: values of the series, missing ones are not known
+        :return:
+        """
+        self.times[self.head] = when
+        row = self.head * len(self.columns)
+        for name, column in self.columns.items():
+            value = values.get(name)
+            self.values[row + column] = nan if value is None else value
+        self.head = (self.head + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def rate(self, name: str, window: float = WAL_RATE_WINDOW) \
+            -> Optional[float]:
+        """
+        Per-second change of a series between its latest value and the
+        oldest one within the window, or the previous one if older.
+        The series only grow, a decrease is a reset
+        and the values before it are ignored
+        :param name: series
+        :param window: seconds
+        :return: None if not enough values are known
+        """
+        width, column = len(self.columns), self.columns[name]
+        newest = (self.head - 1) % self.capacity
+        latest = self.values[newest * width + column]
+        if isnan(latest):
+            return None
+
+        oldest, following = None, latest
+        for age in range(1, self.size):
+            row = (newest - age) % self.capacity
+            value = self.values[row * width + column]
+            if isnan(value) or value > following:
+                break
+            if oldest is not None and \
+                    self.times[newest] - self.times[row] > window:
+                break
+            oldest, following = row, value
+
+        if oldest is None or self.times[newest] <= self.times[oldest]:
+            return None
+        return (latest - self.values[oldest * width + column]) \
+            / (self.times[newest] - self.times[oldest])
+
+
+class StateTracker:
+    """
+    Follows the role, timeline and state of a node across scrapes,
+    so that their changes between two scrapes of Prometheus are counted
+    """
+    def __init__(self):
+        # last known values, a value missing in a scrape is kept
+        self.role = self.timeline = self.state = None
+        # the data of the `TRACKED_SECTIONS`
+        self.sections = {
+            'role_counter': {'changes': 0},
+            'timeline_counter': {'changes': 0},
+            'state_transitions': Counter(),
+            'state_gauge': {},
+        }
+
+    def observe(self, scrape: Dict) -> None:
+        """
+        :param scrape: decoded response of the `/patroni` endpoint
+        :return:
+        """
+        role = scrape.get('role', self.role)
+        timeline = scrape.get('timeline', self.timeline)
+        state = scrape.get('state', self.state)
+
+        changed = False
+        if self.role is not None and role != self.role:
+            self.sections['role_counter']['changes'] += 1
+            changed = True
+        if self.timeline is not None and timeline != self.timeline:
+            self.sections['timeline_counter']['changes'] += 1
+            changed = True
+        if self.state is not None and state != self.state:
+            self.sections['state_transitions'][(self.state, state)] += 1
+            changed = True
+        if changed:
+            self.sections['state_gauge']['last_transition_timestamp'] = \
+                time.time()
+
+        self.role, self.timeline, self.state = role, timeline, state
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a unix socket
+    """
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class HTTPTransport:
+    """
+    Lightweight client of the Patroni API used by `--transport=http`.
+    Sends bare HTTP/1.1 requests over a single kept-alive connection,
+    by TCP or by the unix socket of a `http+unix://` URL
+    """
+    def __init__(self, url: str, timeout: float,
+                 ssl_context: Optional['ssl.SSLContext'] = None):
+        self.url = urlparse(url)
+        self.path = self.url.path or '/'
+        if self.url.query:
+            self.path = f'{self.path}?{self.url.query}'
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self.connection: Optional[http.client.HTTPConnection] = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> http.client.HTTPConnection:
+        if self.url.scheme == UNIX_SCHEME:
+            return UnixHTTPConnection(unquote(self.url.netloc), self.timeout)
+        if self.url.scheme == 'https':
+            return http.client.HTTPSConnection(self.url.hostname,
+                                               self.url.port,
+                                               timeout=self.timeout,
+                                               context=self.ssl_context)
+        return http.client.HTTPConnection(self.url.hostname, self.url.port,
+                                          timeout=self.timeout)
+
+    def get(self) -> Tuple[int, bytes]:
+        """
+        Send a GET request with no headers but `Host`
+        :return: status code and body of the response
+        """
+        with self.lock:
+            # a kept-alive connection might have been closed by Patroni
+            # in the meantime, in which case one more attempt is made
+            attempts = 2 if self.connection else 1
+            for attempt in range(attempts):
+                if not self.connection:
+                    self.connection = self.connect()
+                try:
+                    self.connection.putrequest('GET', self.path,
+                                               skip_accept_encoding=True)
+                    self.connection.endheaders()
+                    response = self.connection.getresponse()
+                    body = response.read()
+                    if response.will_close:
+                        self.close()
+                    return response.status, body
+                except (http.client.HTTPException, OSError) as e:
+                    self.close()
+                    # a timeout is not retried not to wait twice as long
+                    if attempt == attempts - 1 or \
+                            isinstance(e, socket.timeout):
+                        raise
+
+    def close(self) -> None:
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+
+class Snapshot(NamedTuple):
+    """
+    Immutable result of one scrape of the Patroni API
+    together with the metric families built from it
+    """
+    generation: int
+    status: str
+    created: float
+    sections: Dict[str, List['Metric']]
+    # sections which have been built, None if all of them
+    built: Optional[FrozenSet[str]] = None
+
+    def covers(self, sections: Optional[FrozenSet[str]]) -> bool:
+        return sections_cover(self.built, sections)
+
 
 class PatroniCollector:
-    def __init__(self, url: str, timeout: int, verify: str):
+    def __init__(self, url: str, timeout: int, verify: str,
+                 poll_interval: float = 0, pool_size: int = 1,
+                 cache_ttl: float = 0, cache_stale: float = 0,
+                 session: Optional['requests.Session'] = None,
+                 mode: str = 'node', json_decoder: Optional[str] = None,
+                 transport: str = 'requests'):
         self.url = url
+        # `node` scrapes the `/patroni` endpoint describing one member,
+        # `cluster` the `/cluster` endpoint describing all of them
+        self.mode = mode
         self.scrape = {}
         self.data: defaultdict[str, Dict[str, Union[str, int, List]]]\
             = defaultdict(dict)
@@ -42,9 +724,81 @@ class PatroniCollector:
             lambda v: v.lower() == 'true' if v in ('true', 'false') else v,
             [verify]
         ))
+        # requests cannot talk over unix sockets
+        if urlparse(url).scheme == UNIX_SCHEME:
+            transport = 'http'
+        self.transport = transport
+        # the session of requests is created by the first blocking fetch,
+        # so that the library is never imported by the asyncio engine
+        self.session = session
+        self.pool_size = pool_size
+        if transport == 'http':
+            self.client = HTTPTransport(
+                url, timeout,
+                self.ssl_context() if url.startswith('https:') else None)
+        else:
+            self.client = None
+        self.decode = import_module(json_decoder or JSON_DECODERS[0]).loads
 
         self.status = '200 OK'
 
+        # when polling in the background, `collect()` only serves
+        # the last snapshot and never talks to Patroni itself
+        self.poll_interval = poll_interval
+        self.snapshot = Snapshot(0, self.status, time.monotonic(), {})
+        # guards `scrape`, `data` and `snapshot` against concurrent refreshes
+        self._refresh_lock = threading.Lock()
+        # data and metric families of the sections built last time,
+        # the families are shared by the snapshots and never modified
+        self._families: Dict[str, Tuple[Any, List['Metric']]] = {}
+        # recent WAL positions by the name of the member
+        self.wal_history: Dict[str, WalHistory] = {}
+        self.state_tracker = StateTracker() if TRACKED_SECTIONS[mode] \
+            else None
+        self._poller = None
+        self._stop_polling = threading.Event()
+
+        # the last successful snapshot is served without scraping Patroni
+        # for `cache_ttl` seconds and for further `cache_stale` seconds
+        # while it is being refreshed in the background
+        self.cache_ttl = cache_ttl
+        self.cache_stale = cache_stale
+        self.last_good = self.snapshot
+        self.cache_hits = Counter()
+        self.cache_misses = 0
+        self._revalidating = threading.Lock()
+
+        # snapshot pinned by the caller for the current thread,
+        # `collect()` serves it instead of getting a new one
+        self._pinned = threading.local()
+
+        # state of the asyncio client
+        self._inflight: Optional['asyncio.Future'] = None
+        self._inflight_sections: Optional[FrozenSet[str]] = None
+        self._connection: Optional[Tuple['asyncio.StreamReader',
+                                         'asyncio.StreamWriter']] = None
+
+    def create_session(self, pool_size: int,
+                       hosts: int = 1) -> 'requests.Session':
+        """
+        Create a long-lived HTTP session for talking to Patroni.
+        Connections (and thus TLS sessions) are kept alive and reused
+        between scrapes instead of being set up for every request
+        :param pool_size: number of connections kept per Patroni host
+        :param hosts: number of Patroni hosts to keep connections to
+        :return:
+        """
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        session.verify = self.requests_verify
+        adapter = HTTPAdapter(pool_connections=hosts,
+                              pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def scrape_patroni(self) -> None:
         """
         Read information from patroni API
@@ -53,26 +807,281 @@ class PatroniCollector:
         """
         logger.debug(f'Scraping Patroni API at {self.url}.')
         try:
-            r = requests.get(self.url, timeout=self.timeout,
-                             verify=self.requests_verify)
-            self.scrape = r.json()
-            if not self.scrape.get('role') == 'replica':
-                r.raise_for_status()
-            self.status = '200 OK'
+            status_code, content = self.fetch()
+            # the body is decoded directly, skipping the charset detection
+            # of requests, as JSON is always sent in UTF-8 by Patroni
+            with stage_timer('decode'):
+                scrape = self.decode(content)
+            self.load_scrape(status_code, scrape)
         except Exception as e:
-            self.status = '503 Service Unavailable'
-            self.scrape = {}
-            logger.error(f'Scraping of Patroni @ {self.url} failed: {e}')
-        logger.debug(f'Scraped data: {self.scrape}')
+            self.scrape_failed(e)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Scraped data: {self.scrape}')
+
+    def fetch(self) -> Tuple[int, bytes]:
+        """
+        Get the response of the Patroni API
+        :return: HTTP status code and the raw body
+        """
+        with stage_timer('fetch'):
+            if self.client:
+                status_code, content = self.client.get()
+            else:
+                if not self.session:
+                    self.session = self.create_session(self.pool_size)
+                r = self.session.get(self.url, timeout=self.timeout)
+                status_code, content = r.status_code, r.content
+        instrumentation().upstream_response_bytes.inc(len(content))
+        return status_code, content
+
+    def load_scrape(self, status_code: int, scrape: Dict) -> None:
+        """
+        Accept a decoded response of the Patroni API as the current scrape
+        :param status_code: HTTP status code of the response
+        :param scrape: decoded JSON body of the response
+        :return:
+        """
+        self.scrape = scrape
+        # replicas respond with 503 but their data are valid
+        if status_code >= 400 and not self.scrape.get('role') == 'replica':
+            from requests import HTTPError
+            raise HTTPError(f'Patroni responded '
+                            f'with HTTP {status_code}')
+        self.status = '200 OK'
+        self.track(scrape)
+
+    def track(self, scrape: Dict) -> None:
+        """
+        Follow the state of the node across scrapes, see `StateTracker`
+        :param scrape: decoded response of the Patroni API
+        :return:
+        """
+        if self.state_tracker:
+            self.state_tracker.observe(scrape)
+
+    def scrape_failed(self, e: Exception) -> None:
+        instrumentation().upstream_errors.labels(type(e).__name__).inc()
+        self.status = '503 Service Unavailable'
+        self.scrape = {}
+        logger.error(f'Scraping of Patroni @ {self.url} failed: {e}')
+
+    def ssl_context(self) -> 'ssl.SSLContext':
+        """
+        Create an SSL context honouring `--requests-verify`
+        for the clients not based on requests
+        :return:
+        """
+        import ssl
+
+        if self.requests_verify is False:
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        elif self.requests_verify is True:
+            context = ssl.create_default_context()
+        elif os.path.isdir(self.requests_verify):
+            context = ssl.create_default_context(capath=self.requests_verify)
+        else:
+            context = ssl.create_default_context(cafile=self.requests_verify)
+        return context
+
+    async def _open_connection(self) -> Tuple['asyncio.StreamReader',
+                                              'asyncio.StreamWriter']:
+        import asyncio
+
+        url = urlparse(self.url)
+        if url.scheme == UNIX_SCHEME:
+            return await asyncio.open_unix_connection(unquote(url.netloc))
+        if url.scheme == 'https':
+            return await asyncio.open_connection(url.hostname,
+                                                 url.port or 443,
+                                                 ssl=self.ssl_context())
+        return await asyncio.open_connection(url.hostname, url.port or 80)
+
+    async def _get_async(self) -> Tuple[int, bytes]:
+        """
+        Send a GET request to the Patroni API over a persistent connection
+        :return: status code and body of the response
+        """
+        url = urlparse(self.url)
+        path = url.path or '/'
+        if url.query:
+            path = f'{path}?{url.query}'
+        host = 'localhost' if url.scheme == UNIX_SCHEME else url.netloc
+
+        # a kept-alive connection might have been closed by Patroni
+        # in the meantime, in which case one more attempt is made
+        attempts = 2 if self._connection else 1
+        for attempt in range(attempts):
+            if not self._connection:
+                self._connection = await self._open_connection()
+            reader, writer = self._connection
+            try:
+                writer.write(f'GET {path} HTTP/1.1\r\n'
+                             f'Host: {host}\r\n'
+                             f'Accept: application/json\r\n'
+                             f'\r\n'.encode('latin-1'))
+                await writer.drain()
+                status_line = await reader.readline()
+                if not status_line:
+                    raise ConnectionResetError('Connection closed by Patroni')
+                version, status_code = status_line.split()[:2]
+                headers = await read_headers(reader)
+
+                if 'chunked' in headers.get('transfer-encoding', ''):
+                    body = await read_chunked(reader)
+                elif 'content-length' in headers:
+                    body = await reader.readexactly(
+                        int(headers['content-length']))
+                else:
+                    body = await reader.read()
+                    headers['connection'] = 'close'
+
+                if version != b'HTTP/1.1' or \
+                        headers.get('connection', '').lower() == 'close':
+                    self._close_connection()
+                return int(status_code), body
+            except ConnectionError:
+                self._close_connection()
+                if attempt == attempts - 1:
+                    raise
+            except BaseException:
+                # including the cancellation on timeout, the state of
+                # the connection is unknown so it cannot be reused
+                self._close_connection()
+                raise
+
+    def _close_connection(self) -> None:
+        if self._connection:
+            self._connection[1].close()
+            self._connection = None
+
+    async def _refresh_async(self, sections: Optional[FrozenSet[str]]) \
+            -> Snapshot:
+        import asyncio
+
+        if sections is not None and not sections:
+            with self._refresh_lock:
+                return self._build_snapshot(sections)
+
+        logger.debug(f'Scraping Patroni API at {self.url}.')
+        try:
+            with stage_timer('fetch'):
+                status_code, body = await asyncio.wait_for(self._get_async(),
+                                                           self.timeout)
+            instrumentation().upstream_response_bytes.inc(len(body))
+            with stage_timer('decode'):
+                scrape, error = self.decode(body), None
+        except Exception as e:
+            status_code, scrape, error = 0, {}, e
+
+        with self._refresh_lock:
+            try:
+                if error:
+                    raise error
+                self.load_scrape(status_code, scrape)
+            except Exception as e:
+                self.scrape_failed(e)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Scraped data: {self.scrape}')
+            return self._build_snapshot(sections)
+
+    async def refresh_async(self, sections: Optional[FrozenSet[str]] = None)\
+            -> Snapshot:
+        """
+        Asyncio variant of `refresh()`. Concurrent callers
+        share the result of the refresh in flight if it builds
+        the sections they need
+        :param sections: sections to build, None for all of them
+        :return: the new snapshot
+        """
+        import asyncio
+
+        if not self._inflight or self._inflight.done() or \
+                not sections_cover(self._inflight_sections, sections):
+            self._inflight_sections = sections
+            self._inflight = asyncio.ensure_future(
+                self._refresh_async(sections))
+        return await asyncio.shield(self._inflight)
+
+    @staticmethod
+    @lru_cache(maxsize=64)
+    def to_timestamp(timestring: str) -> float:
+        """
+        Convert an ISO 8601 time to unix time. The format used by Patroni
+        is parsed directly, anything else is left to dateutil.
+        Results are memoized as e.g. `postmaster_start_time` is the same
+        in every scrape
+        :param timestring:
+        :return:
+        """
+        match = ISO_TIMESTAMP.match(timestring)
+        if not match:
+            from dateutil.parser import parse
+            logger.debug(f'Converting {timestring} to unix timestamp '
+                         f'by dateutil')
+            return parse(timestring).timestamp()
+
+        (year, month, day, hour, minute, second, fraction,
+         utc, sign, offset_hours, offset_minutes) = match.groups()
+        tz = None
+        if utc:
+            tz = timezone.utc
+        elif sign:
+            offset = timedelta(hours=int(offset_hours),
+                               minutes=int(offset_minutes))
+            tz = timezone(-offset if sign == '-' else offset)
+        # times without an offset are in the local time
+        return datetime(int(year), int(month), int(day),
+                        int(hour), int(minute), int(second),
+                        int(fraction.ljust(6, '0')) if fraction else 0,
+                        tzinfo=tz).timestamp()
 
     @staticmethod
-    def to_timestamp(timestring: str) -> int:
-        logger.debug(f'Converting {timestring} to unix timestamp')
-        return int(parse(timestring).strftime('%s'))
+    @lru_cache(maxsize=None)
+    def compile_plan(mode: str) -> Tuple[Dict[str, PlanItem],
+                                         Tuple[Tuple[str, str, Any], ...]]:
+        """
+        Compile the mappings of the given mode into a flat table
+        telling how to preprocess each key of the Patroni response
+        :param mode:
+        :return: the table and (section, key, default) of the keys
+                 which are set even when missing in the response
+        """
+        plan = {}
+        timestamps = TIMESTAMP_MAPPINGS[mode]
+
+        for section, scrape_key in DIRECT_MAPPINGS[mode].items():
+            convert = None
+            if section in timestamps:
+                convert = partial(PatroniCollector._convert_timestamps,
+                                  timestamps[section])
+            plan[scrape_key] = PlanItem(section, None, convert)
 
-    def preprocessing(self) -> None:
+        defaults = []
+        for section, items in SCRAPE_MAPPINGS[mode].items():
+            for item in items:
+                convert = None
+                if item in timestamps.get(section, ()):
+                    convert = PatroniCollector.to_timestamp
+                plan[item] = PlanItem(section, item, convert)
+                if item in FALSE_DEFAULTS:
+                    defaults.append((section, item, False))
+
+        return plan, tuple(defaults)
+
+    @staticmethod
+    def _convert_timestamps(keys: Tuple[str, ...], data: Dict) -> Dict:
+        # replayed_timestamp is None when cluster is fresh and
+        # no data have been replayed on slave
+        return {k: PatroniCollector.to_timestamp(v) if k in keys else v
+                for k, v in data.items() if not (k in keys and v is None)}
+
+    def preprocessing(self, sections: Optional[FrozenSet[str]] = None) \
+            -> None:
         """
         Group data from Patroni into logical blocks
+        :param sections: blocks to fill, None for all of them
         :return:
         """
 
@@ -82,85 +1091,199 @@ class PatroniCollector:
         if not self.scrape:
             return
 
-        # values here specify which keys from scrape
-        # will go to which data sections
-        scrape_mapping = {
-            'postgresql_info': ('server_version', 'database_system_identifier'),
-            'patroni_info': ('role', 'state'),
-            'postgresql_gauge': ('postmaster_start_time', 'timeline',
-                                 'pending_restart'),
-            'patroni_gauge': ('cluster_unlocked', 'pause'),
-        }
+        plan, defaults = self.compile_plan(self.mode)
+        unprocessed = {}
+        for key, value in self.scrape.items():
+            item = plan.get(key)
+            if not item:
+                unprocessed[key] = value
+                continue
 
-        # these records consist of a dict or a list of dict (replication)
-        # and we don't want to put them into a sub-dict,
-        # but use them as they are
-        direct_mapping = {
-            'xlog_gauge': 'xlog',
-            'patroni_info': 'patroni',
-            'replication_info': 'replication'
-        }
+            if sections is not None and item.section not in sections:
+                continue
 
-        # timestamps to convert to unix time
-        timestamp_mapping = {
-            'postgresql_gauge': ('postmaster_start_time',),
-            'xlog_gauge': ('replayed_timestamp',)
-        }
-
-        # use direct mapping to populate data
-        for data_key, scrape_key in direct_mapping.items():
-            logger.debug(f'Pre-processing {data_key}')
-            if scrape_key in self.scrape:
-                self.data[data_key] = self.scrape.pop(scrape_key)
-
-        # use the rest of scrape data to populate data
-        for key, values in scrape_mapping.items():
-            for item in values:
-                logger.debug(f'Pre-processing {item}')
-                if item in self.scrape:
-                    self.data[key][item] = self.scrape.pop(item)
-
-                if item in {'pending_restart', 'cluster_unlocked', 'pause'} \
-                        and item not in self.data[key]:
-                    logger.debug(f'`{item}`` not in scrape, setting to False')
-                    self.data[key][item] = False
+            if item.convert:
+                if value is None:
                     continue
+                value = item.convert(value)
 
-        # change to timestamp
-        for key, items in timestamp_mapping.items():
-            for item in items:
-                if key in self.data and item in self.data[key]:
-                    # replayed_timestamp is None when cluster is fresh and
-                    # no data have been replayed on slave
-                    if self.data[key][item] is None:
-                        self.data[key].pop(item)
-                        continue
-                    self.data[key][item] = self.to_timestamp(
-                        self.data[key][item]
-                    )
-
-        logger.debug(f'Preprocessed data: {self.data}')
-
-        if self.scrape:
+            if item.key:
+                self.data[item.section][item.key] = value
+            elif isinstance(value, dict):
+                # the section may also contain keys mapped one by one
+                self.data[item.section].update(value)
+            else:
+                self.data[item.section] = value
+
+        for section, key, default in defaults:
+            if sections is None or section in sections:
+                self.data[section].setdefault(key, default)
+
+        for section, source, derive in DERIVED_MAPPINGS[self.mode]:
+            if (sections is None or section in sections) \
+                    and source in self.data:
+                derived = getattr(self, derive)(self.data[source])
+                if derived:
+                    self.data[section] = derived
+
+        for section in TRACKED_SECTIONS[self.mode]:
+            values = self.state_tracker.sections[section]
+            if values and (sections is None or section in sections):
+                # copied as the tracker keeps changing them
+                self.data[section] = values.copy()
+
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Preprocessed data: {self.data}')
+
+        if unprocessed:
             logger.warning(f'Not all metrics '
-                           f'has been preprocessed: {self.scrape}')
+                           f'has been preprocessed: {unprocessed}')
+
+    @staticmethod
+    def _derive_replication_lag(xlog: Dict) -> Dict[str, float]:
+        """
+        Lag of a replica replaying the WAL it has received
+        :param xlog: preprocessed `xlog` of the node
+        :return: empty on a primary
+        """
+        received = xlog.get('received_location')
+        replayed = xlog.get('replayed_location')
+        if received is None or replayed is None:
+            return {}
+
+        lag = {'bytes': max(received - replayed, 0)}
+        # the last replayed transaction gets old also when
+        # there is nothing to replay, which is no lag at all
+        if received == replayed:
+            lag['seconds'] = 0
+        elif 'replayed_timestamp' in xlog:
+            lag['seconds'] = max(time.time() - xlog['replayed_timestamp'], 0)
+        return lag
+
+    @staticmethod
+    def _derive_member_lag(members: List[Dict]) -> List[Dict]:
+        """
+        Add the lag in bytes behind the WAL position of the leader
+        to every member. Members without known positions get the lag
+        reported by Patroni instead
+        :param members: preprocessed `members` of the cluster
+        :return:
+        """
+        leader = next((parse_lsn(m.get('lsn')) for m in members
+                       if m.get('role') in LEADER_ROLES), None)
+        derived = []
+        for member in members:
+            lag = member.get('lag')
+            if member.get('role') in LEADER_ROLES:
+                lag = 0
+            elif leader is not None:
+                position = parse_lsn(member.get('replay_lsn',
+                                                member.get('receive_lsn')))
+                if position is not None:
+                    lag = max(leader - position, 0)
+            derived.append({**member, 'lag_bytes': lag})
+        return derived
+
+    def _wal_rates(self, member: str, positions: Dict, lag: Any) \
+            -> Dict[str, float]:
+        """
+        Record the WAL positions of a member and compute their rates
+        :param member: name of the member
+        :param positions: WAL positions by the keys of `WAL_RATE_MAPPINGS`
+        :param lag: bytes the member is behind, None if not a replica
+        :return: the rates and the estimated seconds to catch up
+        """
+        mapping = WAL_RATE_MAPPINGS[self.mode]
+        history = self.wal_history.get(member)
+        if history is None:
+            history = self.wal_history[member] = WalHistory(mapping)
+        if not isinstance(lag, (int, float)):
+            lag = None
+        history.append(time.monotonic(),
+                       {k: parse_lsn(positions.get(k)) for k in mapping})
+
+        rates = {}
+        for key, name in mapping.items():
+            rate = history.rate(key)
+            if rate is not None:
+                rates[f'{name}_bytes_per_second'] = rate
+
+        # the lag of a streaming replica hardly ever shrinks steadily,
+        # so the time to catch up is estimated by the pace of replaying
+        replayed = rates.get('replayed_bytes_per_second')
+        if lag == 0:
+            rates['catchup_seconds'] = 0
+        elif lag is not None and replayed:
+            rates['catchup_seconds'] = lag / replayed
+        return rates
+
+    def _derive_wal_rates(self, xlog: Dict) -> Dict[str, float]:
+        """
+        Rates of the WAL of the node and the time to replay what
+        it has received
+        :param xlog: preprocessed `xlog` of the node
+        :return:
+        """
+        lag = None
+        if 'received_location' in xlog and 'replayed_location' in xlog:
+            lag = xlog['received_location'] - xlog['replayed_location']
+        return self._wal_rates('', xlog, lag)
+
+    def _derive_member_wal_rates(self, members: List[Dict]) -> List[Dict]:
+        """
+        Add the rates of the WAL of every member and the time to catch up
+        with the leader, see `_derive_member_lag()`
+        :param members: preprocessed `members` of the cluster
+        :return:
+        """
+        names = {str(m.get('name')) for m in members}
+        for name in [*self.wal_history]:
+            if name not in names:
+                del self.wal_history[name]
+
+        derived = []
+        for member in members:
+            lag = member.get('lag_bytes')
+            if member.get('role') in LEADER_ROLES:
+                lag = None
+            rates = self._wal_rates(str(member.get('name')), member, lag)
+            derived.append({**member, **{f'wal_{k}': v
+                                         for k, v in rates.items()}})
+        return derived
+
+    @staticmethod
+    def _process_gauge(data: Dict, label: str) -> 'List[Metric]':
+        metrics = []
+        for k, v in data.items():
+            t = family_template(f'patroni_{label}_{k}',
+                                f'{label} gauge {k}', 'gauge')
+            metrics.append(t.family([t.sample((), float(v))]))
+
+        return metrics
 
     @staticmethod
-    def _process_gauge(data: Dict, label: str) -> List[GaugeMetricFamily]:
+    def _process_counter(data: Dict, label: str) -> 'List[Metric]':
         metrics = []
         for k, v in data.items():
-            g = GaugeMetricFamily(f'patroni_{label}_{k}',
-                                  f'{label} gauge {k}')
-            g.add_metric([k], float(v))
-            metrics.append(g)
+            t = family_template(f'patroni_{label}_{k}',
+                                f'{label} counter {k}', 'counter')
+            metrics.append(t.family([t.sample((), float(v))]))
 
         return metrics
 
+    @staticmethod
+    def _process_transitions(data: Dict[Tuple[str, str], int],
+                             label: str) -> 'List[Metric]':
+        t = family_template(f'patroni_{label}_transitions',
+                            f'{label} transitions', 'counter',
+                            ('from', 'to'))
+        return [t.family([t.sample((str(old), str(new)), float(count))
+                          for (old, new), count in data.items()])]
+
     @staticmethod
     def _process_info(data: Union[Dict, List[Dict]],
-                      label: str) -> List[InfoMetricFamily]:
-        i = InfoMetricFamily(f'patroni_{label}',
-                             f'{label} info')
+                      label: str) -> 'List[Metric]':
+        t = family_template(f'patroni_{label}', f'{label} info', 'info')
 
         # to ensure we have an iterable of dicts
         # the info datasets are different, some are lists of dicts,
@@ -168,38 +1291,798 @@ class PatroniCollector:
         if not isinstance(data, (list, tuple)):
             data = [data]
 
-        for dataset in data:
-            i.add_metric([], {k: str(v) for k, v in dataset.items()})
-        return [i]
+        return [t.family([t.sample((), info={k: str(v)
+                                             for k, v in dataset.items()})
+                          for dataset in data])]
+
+    @staticmethod
+    def _process_members(data: List[Dict], label: str) -> 'List[Metric]':
+        i = family_template(f'patroni_{label}_member',
+                            f'{label} member info', 'info', ('member',))
+        gauges = {k: family_template(f'patroni_{label}_member_{k}',
+                                     f'{label} member gauge {k}', 'gauge',
+                                     ('member',))
+                  for k in CLUSTER_MEMBER_GAUGES}
 
-    def process_data(self) -> Dict[str, List[Union[GaugeMetricFamily,
-                                                   InfoMetricFamily]]]:
+        info_samples = []
+        gauge_samples = {k: [] for k in gauges}
+        for member in data:
+            name = str(member.get('name'))
+            info_samples.append(i.sample(
+                (name,), info={k: str(v) for k, v in member.items()
+                               if k not in gauges and k != 'name'
+                               and k not in CLUSTER_MEMBER_LSNS}))
+            for k, g in gauges.items():
+                # lag is `unknown` when it cannot be determined
+                if isinstance(member.get(k), (int, float)):
+                    gauge_samples[k].append(g.sample((name,),
+                                                     float(member[k])))
+        return [i.family(info_samples),
+                *(g.family(gauge_samples[k]) for k, g in gauges.items())]
+
+    def process_data(self, sections: Optional[FrozenSet[str]] = None) \
+            -> 'Dict[str, List[Metric]]':
         """
         Iterate over the preprocessed data and call respective functions
         to create prometheus metrics
+        :param sections: sections to process, None for all of them
         """
         metrics = {}
         for key, value in self.data.items():
+            if sections is not None and key not in sections:
+                continue
+            # most of the data do not change between scrapes, so
+            # the families of an unchanged section are reused as they are
+            built = self._families.get(key)
+            if built and built[0] == value:
+                metrics[key] = built[1]
+                continue
             label, func_type = key.rsplit('_', 1)
             func = getattr(self, f'_process_{func_type}', None)
             if not func:
                 raise RuntimeError(f'Metric for {key} cannot be processed. '
                                    f'Required function not found')
             metrics[key] = func(value, label)
+            self._families[key] = (value, metrics[key])
         return metrics
 
-    def collect(self) -> Union[GaugeMetricFamily, InfoMetricFamily]:
+    def refresh(self, sections: Optional[FrozenSet[str]] = None) \
+            -> Snapshot:
+        """
+        Scrape Patroni and replace the current snapshot with a new one
+        Concurrent callers are coalesced: whoever arrives while a refresh
+        is in flight waits for it and shares its result
+        :param sections: sections to build, None for all of them.
+                         Patroni is not scraped at all if none are needed
+        :return: the new snapshot
+        """
+        generation = self.snapshot.generation
+        with self._refresh_lock:
+            # the snapshot has been refreshed while waiting for the lock
+            if self.snapshot.generation != generation and \
+                    self.snapshot.covers(sections):
+                return self.snapshot
+
+            if sections is None or sections:
+                self.scrape_patroni()
+            return self._build_snapshot(sections)
+
+    def _build_snapshot(self, sections: Optional[FrozenSet[str]] = None) \
+            -> Snapshot:
+        built = {}
+        if sections is None or sections:
+            with stage_timer('preprocess'):
+                self.preprocessing(sections)
+            with stage_timer('process'):
+                built = self.process_data(sections)
+
+        self.snapshot = Snapshot(generation=self.snapshot.generation + 1,
+                                 status=self.status,
+                                 created=time.monotonic(),
+                                 sections=built,
+                                 built=sections)
+        if self.snapshot.status == '200 OK' and sections is None:
+            self.last_good = self.snapshot
+        return self.snapshot
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def section_prefixes(mode: str) -> Dict[str, str]:
+        """
+        :param mode:
+        :return: prefix of the names of metrics built from each section
+        """
+        sections = [*SCRAPE_MAPPINGS[mode], *DIRECT_MAPPINGS[mode],
+                    *(section for section, _, _ in DERIVED_MAPPINGS[mode]),
+                    *TRACKED_SECTIONS[mode]]
+        return {section: f'patroni_{section.rsplit("_", 1)[0]}_'
+                for section in sections}
+
+    def sections_for(self, names: Iterable[str]) -> FrozenSet[str]:
+        """
+        Find the sections needed to build the metrics of the given names
+        :param names:
+        :return:
+        """
+        sections = {
+            section for section, prefix
+            in self.section_prefixes(self.mode).items()
+            if any(name.startswith(prefix) for name in names)
+        }
+        # derived sections need the data of their sources
+        for section, source, _ in DERIVED_MAPPINGS[self.mode]:
+            if section in sections:
+                sections.add(source)
+        return frozenset(sections)
+
+    def _revalidate(self) -> None:
+        # at most one background refresh at a time
+        if not self._revalidating.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f'Background refresh of Patroni failed: {e}')
+            finally:
+                self._revalidating.release()
+
+        threading.Thread(target=run, name='patroni-revalidate',
+                         daemon=True).start()
+
+    def _revalidate_async(self) -> None:
+        import asyncio
+
+        if self._inflight and not self._inflight.done():
+            return
+
+        def done(future: 'asyncio.Future') -> None:
+            if not future.cancelled() and future.exception():
+                logger.error(f'Background refresh of Patroni failed: '
+                             f'{future.exception()}')
+
+        self._inflight_sections = None
+        self._inflight = asyncio.ensure_future(self._refresh_async(None))
+        self._inflight.add_done_callback(done)
+
+    def _cached(self) -> Tuple[Optional[Snapshot], bool]:
+        """
+        Look up the snapshot cache
+        :return: the cached snapshot (None on a miss) and whether it is stale
+        """
+        if self.cache_ttl or self.cache_stale:
+            snapshot = self.last_good
+            age = time.monotonic() - snapshot.created
+            if snapshot.generation and age < self.cache_ttl:
+                self.cache_hits['fresh'] += 1
+                return snapshot, False
+            if snapshot.generation and \
+                    age < self.cache_ttl + self.cache_stale:
+                self.cache_hits['stale'] += 1
+                return snapshot, True
+            self.cache_misses += 1
+        return None, False
+
+    def get_snapshot(self, sections: Optional[FrozenSet[str]] = None) \
+            -> Snapshot:
+        """
+        Get the snapshot to serve according to the polling
+        and caching configuration, refreshing it if needed
+        :param sections: sections needed, None for all of them
+        :return:
+        """
+        if self.poll_interval:
+            return self.snapshot
+
+        snapshot, stale = self._cached()
+        if not snapshot:
+            return self.refresh(sections)
+        if stale:
+            self._revalidate()
+        return snapshot
+
+    async def get_snapshot_async(self,
+                                 sections: Optional[FrozenSet[str]] = None)\
+            -> Snapshot:
+        """
+        Asyncio variant of `get_snapshot()`
+        :param sections: sections needed, None for all of them
+        :return:
+        """
+        if self.poll_interval:
+            return self.snapshot
+
+        snapshot, stale = self._cached()
+        if not snapshot:
+            return await self.refresh_async(sections)
+        if stale:
+            self._revalidate_async()
+        return snapshot
+
+    def current_snapshot(self, sections: Optional[FrozenSet[str]] = None) \
+            -> Snapshot:
+        """
+        Get the snapshot pinned for the current thread
+        or the one to serve now
+        :param sections: sections needed, None for all of them
+        :return:
+        """
+        return getattr(self._pinned, 'snapshot', None) \
+            or self.get_snapshot(sections)
+
+    @contextmanager
+    def pinned(self, snapshot: Optional[Snapshot]):
+        """
+        Make `collect()` in the current thread serve the given snapshot
+        instead of getting one itself
+        :param snapshot: snapshot to serve, None does not pin anything
+        :return:
+        """
+        previous = getattr(self._pinned, 'snapshot', None)
+        self._pinned.snapshot = snapshot or previous
+        try:
+            yield
+        finally:
+            self._pinned.snapshot = previous
+
+    def _collect_cache_stats(self, snapshot: Snapshot) \
+            -> 'Iterable[Union[GaugeMetricFamily, CounterMetricFamily]]':
+        from prometheus_client.core import (
+            GaugeMetricFamily, CounterMetricFamily
+        )
+        yield GaugeMetricFamily('patroni_exporter_cache_age_seconds',
+                                'Age of the served Patroni snapshot',
+                                value=time.monotonic() - snapshot.created)
+        if not (self.cache_ttl or self.cache_stale):
+            return
+
+        hits = CounterMetricFamily('patroni_exporter_cache_hits',
+                                   'Scrapes served from the snapshot cache',
+                                   labels=['freshness'])
+        for freshness in ('fresh', 'stale'):
+            hits.add_metric([freshness], self.cache_hits[freshness])
+        yield hits
+        yield CounterMetricFamily('patroni_exporter_cache_misses',
+                                  'Scrapes which had to wait for Patroni',
+                                  value=self.cache_misses)
+
+    def _poll(self) -> None:
+        while not self._stop_polling.is_set():
+            started = time.monotonic()
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f'Background polling of Patroni failed: {e}')
+            elapsed = time.monotonic() - started
+            self._stop_polling.wait(max(self.poll_interval - elapsed, 0))
+
+    def start_polling(self) -> None:
+        """
+        Start a daemon thread refreshing the snapshot every `poll_interval`
+        seconds. Does nothing when polling is disabled.
+        :return:
+        """
+        if not self.poll_interval or self._poller:
+            return
+        self._stop_polling.clear()
+        self._poller = threading.Thread(target=self._poll,
+                                        name='patroni-poller',
+                                        daemon=True)
+        self._poller.start()
+
+    def stop_polling(self) -> None:
+        if not self._poller:
+            return
+        self._stop_polling.set()
+        self._poller.join()
+        self._poller = None
+
+    def describe(self) -> 'Iterable[Metric]':
+        """
+        Describes no metrics, as they change with the data of Patroni.
+        Otherwise the registry would learn them by calling `collect()`
+        on registration, which scrapes Patroni, or sees no data yet
+        when polling
+        """
+        return []
+
+    def collect_snapshot(self, names: Optional[Iterable[str]] = None) \
+            -> 'Iterable[Metric]':
+        """
+        Collect the metrics built from the snapshot of Patroni,
+        which only change with the snapshot
+        :param names: names of the samples to collect, None for all of them
+        :return:
+        """
+        if names is None:
+            for name, metrics in self.current_snapshot().sections.items():
+                logger.debug(f'Processing section {name}')
+                yield from metrics
+            return
+
+        sections = self.sections_for(names)
+        snapshot = self.current_snapshot(sections)
+        # only the sections with the requested metrics are looked at
+        yield from restrict_metrics(
+            (metric for section, metrics in snapshot.sections.items()
+             if section in sections for metric in metrics), names)
+
+    def collect_stats(self, names: Optional[Iterable[str]] = None) \
+            -> 'Iterable[Metric]':
+        """
+        Collect the metrics of the snapshot cache,
+        which change with every scrape
+        :param names: names of the samples to collect, None for all of them
+        :return:
+        """
+        if not (self.poll_interval or self.cache_ttl or self.cache_stale):
+            return
+        metrics = self._collect_cache_stats(self.current_snapshot())
+        yield from metrics if names is None \
+            else restrict_metrics(metrics, names)
+
+    def collect(self) -> 'Iterable[Metric]':
         """Collects metrics from patroni.
            It is used by the prometheus_client library
         """
-        self.scrape_patroni()
-        self.preprocessing()
+        yield from self.collect_snapshot()
+        yield from self.collect_stats()
+
+
+class SharedScrape:
+    """
+    The last response of the Patroni API in memory shared with the forked
+    `--workers`, followed by the state derived from it across scrapes.
+    Only the parent process writes it. The sequence number in the header
+    is odd while the response is being written, readers retry when it is
+    odd or changes while they read
+    """
+    # sequence number, HTTP status code (0 on failure),
+    # length of the body, length of the state
+    HEADER = struct.Struct('=QiII')
+
+    def __init__(self, size: int = SHARED_SCRAPE_SIZE):
+        # anonymous mappings are shared with the children after fork()
+        self.buffer = mmap.mmap(-1, size)
+
+    def sequence(self) -> int:
+        return self.HEADER.unpack_from(self.buffer)[0]
+
+    def write(self, status_code: int, body: bytes, state: bytes = b'') \
+            -> None:
+        """
+        :param status_code: 0 if the scrape failed
+        :param body: the body of the response or the error
+        :param state: serialized state derived from the responses
+        :return:
+        """
+        end = self.HEADER.size + len(body) + len(state)
+        if end > len(self.buffer):
+            raise ValueError(f'The response of {len(body)} bytes '
+                             f'does not fit the shared memory')
+        sequence = self.sequence()
+        self.HEADER.pack_into(self.buffer, 0, sequence + 1, 0, 0, 0)
+        self.buffer[self.HEADER.size:end] = body + state
+        self.HEADER.pack_into(self.buffer, 0, sequence + 2,
+                              status_code, len(body), len(state))
+
+    def read(self, timeout: float = SHARED_READ_TIMEOUT) \
+            -> Tuple[int, int, bytes, bytes]:
+        """
+        :param timeout: seconds to wait for the response being written
+        :return: sequence number, HTTP status code, body and state
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            sequence, status_code, length, state_length = \
+                self.HEADER.unpack_from(self.buffer)
+            if sequence % 2 == 0:
+                start = self.HEADER.size
+                body = self.buffer[start:start + length]
+                state = self.buffer[start + length:
+                                    start + length + state_length]
+                if self.sequence() == sequence:
+                    return sequence, status_code, body, state
+            if time.monotonic() > deadline:
+                raise TimeoutError('The shared response of Patroni '
+                                   'has not been completely written')
+            time.sleep(0)
+
+
+class SharedCollector(PatroniCollector):
+    """
+    Collector of the `--workers` mode. Only the parent process scrapes
+    Patroni and publishes the responses in the shared memory, so the load
+    of Patroni does not grow with the number of workers, which build
+    their snapshots from the published responses.
+    The state followed across scrapes, the changes of the node and the
+    rates of the WAL, is only kept by the parent process and published
+    along with the responses, so that it is the same in all the workers
+    and survives their restarts
+    """
+    def __init__(self, shared: SharedScrape, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.shared = shared
+        # sequence number of the response the snapshot is built from
+        self.sequence = None
+        # the process publishing the responses
+        self.parent = os.getpid()
+        # rates of the WAL by the name of the member, computed by
+        # the parent process and read from the shared memory by workers
+        self.wal_rates: Dict[str, Dict[str, float]] = {}
+
+    def publish(self) -> None:
+        """
+        Scrape Patroni and publish the response to the workers
+        :return:
+        """
+        import pickle
+
+        try:
+            status_code, content = super().fetch()
+        except Exception as e:
+            logger.error(f'Scraping of Patroni @ {self.url} failed: {e}')
+            self.shared.write(0, f'{type(e).__name__}: {e}'.encode())
+            return
+
+        self.wal_rates = {}
+        try:
+            self.load_scrape(status_code, self.decode(content))
+            self.preprocessing()
+        except Exception as e:
+            # the workers fail to build their snapshots the same way
+            logger.debug(f'Processing of the response failed: {e}')
+        sections = self.state_tracker.sections if self.state_tracker \
+            else {}
+        self.shared.write(status_code, content, pickle.dumps(
+            (sections, self.wal_rates), pickle.HIGHEST_PROTOCOL))
+
+    def fetch(self) -> Tuple[int, bytes]:
+        import pickle
+
+        self.sequence, status_code, content, state = self.shared.read()
+        if state:
+            sections, self.wal_rates = pickle.loads(state)
+            if self.state_tracker:
+                self.state_tracker.sections = sections
+        if not status_code:
+            raise RuntimeError(content.decode()
+                               or 'Patroni has not been scraped yet')
+        return status_code, content
+
+    def _poll(self) -> None:
+        # a check of the shared memory is cheap, so it is checked often
+        # to serve a new response soon after it has been published
+        seen, changed = None, time.monotonic()
+        while not self._stop_polling.is_set():
+            # the worker is adopted by another process then
+            if os.getppid() != self.parent:
+                logger.error('The main process has exited, '
+                             'stopping the worker')
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+
+            sequence = self.shared.sequence()
+            if sequence != seen:
+                seen, changed = sequence, time.monotonic()
+            if sequence != self.sequence:
+                try:
+                    self.refresh()
+                except Exception as e:
+                    logger.error(f'Reading of the shared response '
+                                 f'of Patroni failed: {e}')
+            if time.monotonic() - changed > \
+                    WORKER_STALE_POLLS * self.poll_interval:
+                # the main process does not publish any more
+                self.status = '503 Service Unavailable'
+            self._stop_polling.wait(WORKER_CHECK_INTERVAL)
+
+    def track(self, scrape: Dict) -> None:
+        # workers take the state published by `fetch()`
+        if os.getpid() == self.parent:
+            super().track(scrape)
+
+    def _wal_rates(self, member: str, positions: Dict, lag: Any) \
+            -> Dict[str, float]:
+        if os.getpid() != self.parent:
+            return self.wal_rates.get(member, {})
+        rates = self.wal_rates[member] = \
+            super()._wal_rates(member, positions, lag)
+        return rates
+
+
+class RenderedMetrics(NamedTuple):
+    """
+    Metrics of Patroni rendered from a snapshot and the digest
+    which their ETag is derived from
+    """
+    output: bytes
+    digest: str
+
+
+class RenderCache:
+    """
+    Rendered metrics of Patroni of the latest snapshot generation.
+    Entries of older generations are dropped once a newer one is stored
+    """
+    def __init__(self):
+        # replaced as a whole, so it can be read without locking
+        self._state: Tuple[int, Dict[Any, Any]] = (0, {})
+        self._lock = threading.Lock()
+
+    def get(self, generation: int, key: Any) -> Optional[Any]:
+        cached_generation, entries = self._state
+        if cached_generation != generation:
+            return None
+        return entries.get(key)
+
+    def put(self, generation: int, key: Any, value: Any) -> None:
+        with self._lock:
+            cached_generation, entries = self._state
+            if generation > cached_generation:
+                self._state = (generation, {key: value})
+            elif generation == cached_generation:
+                entries[key] = value
+
+
+class RegistryView(NamedTuple):
+    """
+    Registry of the metrics collected by the given function,
+    which the encoders of prometheus_client accept
+    """
+    collect: Callable[[], 'Iterable[Metric]']
 
-        sections = self.process_data()
-        for name, metrics in sections.items():
-            logger.debug(f'Processing section {name}')
-            for metric in metrics:
-                yield metric
+
+class ProbeCollector:
+    """
+    Reports the outcome of a `/probe` request
+    """
+    def __init__(self, snapshot: Snapshot, duration: float):
+        self.snapshot = snapshot
+        self.duration = duration
+
+    def collect(self) -> 'Iterable[GaugeMetricFamily]':
+        from prometheus_client.core import GaugeMetricFamily
+        yield GaugeMetricFamily('probe_success',
+                                'Whether the Patroni API has been scraped',
+                                value=self.snapshot.status == '200 OK')
+        yield GaugeMetricFamily('probe_duration_seconds',
+                                'Duration of the probe',
+                                value=self.duration)
+
+
+class ExporterServerHandler(ServerHandler):
+    def cleanup_headers(self) -> None:
+        super().cleanup_headers()
+        # the length of 304 would be that of the omitted body,
+        # which wsgiref takes for the empty one (RFC 9110, 8.6)
+        if self.status.startswith('304'):
+            del self.headers['Content-Length']
+
+
+class KeepAliveServerHandler(ExporterServerHandler):
+    http_version = '1.1'
+
+    def close(self) -> None:
+        # the end of the body is only known when the connection is closed
+        if not self.headers or 'Content-Length' not in self.headers \
+                and not self.status.startswith('304'):
+            self.request_handler.close_connection = True
+        super().close()
+
+
+class ExporterRequestHandler(WSGIRequestHandler):
+    """
+    WSGI request handler serving a single request
+    by `ExporterServerHandler`
+    """
+    server_handler: Type[ServerHandler] = ExporterServerHandler
+    multithread = False
+
+    def handle(self) -> None:
+        self.handle_one_request()
+
+    def handle_one_request(self) -> None:
+        # mirrors `WSGIRequestHandler.handle()`
+        self.raw_requestline = self.rfile.readline(65537)
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ''
+            self.request_version = ''
+            self.command = ''
+            self.send_error(414)
+            return
+
+        if not self.parse_request():
+            return
+
+        handler = self.server_handler(
+            self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+            multithread=self.multithread,
+        )
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+
+
+class KeepAliveRequestHandler(ExporterRequestHandler):
+    """
+    WSGI request handler serving multiple HTTP/1.1 requests
+    on one connection. Between the requests, the connection is handed
+    back to `PooledWSGIServer` instead of holding the thread
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = REQUEST_TIMEOUT
+    server_handler = KeepAliveServerHandler
+    multithread = True
+    # the status line, headers and body are written separately
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        # there is no Nagle's algorithm on unix sockets
+        if self.request.family == socket.AF_UNIX:
+            self.disable_nagle_algorithm = False
+        super().setup()
+        # the buffer of a kept-alive connection may hold the next request
+        rfile = self.server.rfiles.pop(self.request, None)
+        if rfile:
+            self.rfile.close()
+            self.rfile = rfile
+
+    def handle(self) -> None:
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+            # requests sent without waiting for the response
+            while not self.close_connection and self.pending():
+                self.handle_one_request()
+        except socket.timeout:
+            self.close_connection = True
+
+    def finish(self) -> None:
+        if self.close_connection:
+            super().finish()
+            return
+        self.wfile.close()
+        self.server.rfiles[self.request] = self.rfile
+
+    def pending(self) -> bool:
+        """
+        :return: whether the next request has arrived already
+        """
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    WSGI server handling requests by a bounded pool of worker threads.
+    Requests which would exceed `max_queue` waiting ones are refused
+    with 503. Kept-alive connections waiting for their next request
+    are watched by a selector and take no thread
+    """
+    max_workers = 4
+    max_queue = 16
+
+    def server_activate(self) -> None:
+        from concurrent.futures import ThreadPoolExecutor
+        super().server_activate()
+        self.pool = ThreadPoolExecutor(self.max_workers,
+                                       thread_name_prefix='wsgi')
+        self.slots = threading.BoundedSemaphore(self.max_workers
+                                                + self.max_queue)
+        # read buffers of the kept-alive connections
+        self.rfiles: Dict[socket.socket, Any] = {}
+        # connections to watch, passed to the watcher thread
+        self.kept = queue.SimpleQueue()
+        self.wakeup, self.wakeup_writer = socket.socketpair()
+        self.idle = selectors.DefaultSelector()
+        self.idle.register(self.wakeup, selectors.EVENT_READ)
+        self.closing = False
+        self.watcher = threading.Thread(target=self.watch_idle,
+                                        name='wsgi-idle', daemon=True)
+        self.watcher.start()
+
+    def finish_request(self, request: socket.socket,
+                       client_address: Any) -> bool:
+        """
+        :return: whether the connection is kept alive
+        """
+        handler = self.RequestHandlerClass(request, client_address, self)
+        return not getattr(handler, 'close_connection', True)
+
+    def keep_alive(self, request: socket.socket,
+                   client_address: Any) -> None:
+        """
+        Watch the connection for its next request
+        :param request:
+        :param client_address:
+        :return:
+        """
+        self.kept.put((request, client_address))
+        self.wakeup_writer.send(b'\0')
+
+    def watch_idle(self) -> None:
+        """
+        Hand the kept-alive connections back to the pool once their next
+        request arrives and close those idle for `KEEPALIVE_TIMEOUT`
+        :return:
+        """
+        while not self.closing:
+            for key, _ in self.idle.select(timeout=1):
+                if key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                    continue
+                self.idle.unregister(key.fileobj)
+                self.process_request(key.fileobj, key.data[0])
+
+            while not self.kept.empty():
+                request, client_address = self.kept.get()
+                self.idle.register(
+                    request, selectors.EVENT_READ,
+                    (client_address, time.monotonic() + KEEPALIVE_TIMEOUT))
+
+            now = time.monotonic()
+            for key in list(self.idle.get_map().values()):
+                if key.fileobj is not self.wakeup and key.data[1] < now:
+                    self.idle.unregister(key.fileobj)
+                    self.shutdown_request(key.fileobj)
+
+        for key in list(self.idle.get_map().values()):
+            if key.fileobj is not self.wakeup:
+                self.shutdown_request(key.fileobj)
+        self.idle.close()
+
+    def process_request(self, request: socket.socket,
+                        client_address: Any) -> None:
+        if not self.slots.acquire(blocking=False):
+            logger.warning(f'Too many connections, refusing {client_address}')
+            try:
+                request.sendall(b'HTTP/1.1 503 Service Unavailable\r\n'
+                                b'Content-Length: 0\r\n'
+                                b'Connection: close\r\n\r\n')
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.pool.submit(self.process_request_worker, request, client_address)
+
+    def process_request_worker(self, request: socket.socket,
+                               client_address: Any) -> None:
+        kept = False
+        try:
+            kept = self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if kept:
+                self.keep_alive(request, client_address)
+            else:
+                self.shutdown_request(request)
+            self.slots.release()
+
+    def shutdown_request(self, request: socket.socket) -> None:
+        # the socket is only closed once its read buffer is
+        rfile = self.rfiles.pop(request, None)
+        if rfile:
+            rfile.close()
+        super().shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.closing = True
+        self.wakeup_writer.send(b'\0')
+        self.watcher.join()
+        self.wakeup.close()
+        self.wakeup_writer.close()
+        self.pool.shutdown(wait=False)
 
 
 class PatroniExporter:
@@ -208,23 +2091,304 @@ class PatroniExporter:
         if self.cmdline.debug:
             logger.setLevel(logging.DEBUG)
 
-        self.collector = PatroniCollector(self.cmdline.url,
-                                          self.cmdline.timeout,
-                                          self.cmdline.requests_verify)
-        REGISTRY.register(self.collector)
+        collector_class = PatroniCollector
+        if self.cmdline.workers:
+            collector_class = partial(SharedCollector, SharedScrape())
+        self.collector = collector_class(self.cmdline.url,
+                                         self.cmdline.timeout,
+                                         self.cmdline.requests_verify,
+                                         self.cmdline.poll_interval,
+                                         self.cmdline.pool_size,
+                                         self.cmdline.cache_ttl,
+                                         self.cmdline.cache_stale,
+                                         mode=self.cmdline.mode,
+                                         json_decoder=self.cmdline.json_decoder,
+                                         transport=self.cmdline.transport)
+        # the metrics of Patroni are rendered apart from the volatile ones
+        # in `REGISTRY`, as they only change with the snapshot, see `app()`
+        self.render_cache = RenderCache()
+        # socket to listen at created by `create_listener()`
+        self.listener: Optional[socket.socket] = None
+        # path of the unix socket bound by the exporter itself,
+        # removed on exit unlike the one passed by systemd
+        self.owned_socket: Optional[str] = None
+
+        # collectors of `/probe` targets sharing one pool of connections,
+        # created by the first probe
+        self.probe_session = None
+        self.probe_collectors: OrderedDict[str, PatroniCollector] \
+            = OrderedDict()
+        self.probe_collectors_lock = threading.Lock()
+        self.probe_slots = threading.BoundedSemaphore(
+            self.cmdline.probe_concurrency)
+
+    def probe_url(self, target: str) -> str:
+        """
+        Complete the `/probe` target to the URL of the Patroni API
+        :param target: URL, `host:port` or `host`
+        :return:
+        :raises ValueError: the scheme of the target is not allowed
+        """
+        if '://' not in target:
+            target = f'http://{target}'
+        url = urlparse(target)
+        if url.scheme not in PROBE_SCHEMES:
+            raise ValueError(f'unsupported scheme {url.scheme!r}')
+        if url.path in ('', '/'):
+            url = url._replace(path=MODE_PATHS[self.cmdline.mode])
+        return url.geturl()
+
+    def probe_collector(self, url: str) -> PatroniCollector:
+        """
+        Get the collector of a `/probe` target.
+        The least recently probed collectors are dropped
+        :param url:
+        :return:
+        """
+        with self.probe_collectors_lock:
+            collector = self.probe_collectors.pop(url, None)
+            if not collector:
+                if not self.probe_session \
+                        and self.cmdline.transport == 'requests':
+                    self.probe_session = self.collector.create_session(
+                        self.cmdline.pool_size, PROBE_TARGETS)
+                collector = PatroniCollector(url,
+                                             self.cmdline.timeout,
+                                             self.cmdline.requests_verify,
+                                             cache_ttl=self.cmdline.cache_ttl,
+                                             cache_stale=self.cmdline.cache_stale,
+                                             session=self.probe_session,
+                                             mode=self.cmdline.mode,
+                                             json_decoder=self.cmdline.json_decoder,
+                                             transport=self.cmdline.transport)
+            self.probe_collectors[url] = collector
+            if len(self.probe_collectors) > PROBE_TARGETS:
+                self.probe_collectors.popitem(last=False)
+            return collector
+
+    def probe(self, target: str, encoder: Any) -> bytes:
+        """
+        Collect metrics of the given Patroni
+        :param target: URL of the Patroni API, see `probe_url()`
+        :param encoder: prometheus_client encoder of the output
+        :return:
+        """
+        started = time.monotonic()
+        collector = self.probe_collector(target)
+        # bounds the number of requests sent to Patroni at once
+        with self.probe_slots:
+            snapshot = collector.get_snapshot()
+
+        from prometheus_client.core import CollectorRegistry
+        registry = CollectorRegistry()
+        registry.register(collector)
+        registry.register(ProbeCollector(snapshot,
+                                         time.monotonic() - started))
+        with collector.pinned(snapshot), \
+                stage_timer('encode'):
+            return encoder(registry)
 
     def get_server_class(self) -> Type['WSGIServer']:
         """
         Creates a WSGI server class with the desired address family set.
         It is a hack to force WSGI to listen on both IPv4 and IPv6
         - it is possible when using AF_INET6 with binding to '' or '::'
+        With `--threads` the server handles requests by a pool of threads,
+        with `--workers` all of them listen at the same port.
+        A socket created by `create_listener()` is used as it is
         :return:
         """
-        class ServerClass(WSGIServer):
-            address_family = getattr(socket, self.cmdline.address_family)
+        reuse_port = bool(self.cmdline.workers)
+        listener = self.listener
+
+        class ServerClass(PooledWSGIServer if self.cmdline.threads
+                          else WSGIServer):
+            address_family = listener.family if listener \
+                else getattr(socket, self.cmdline.address_family)
+            request_queue_size = self.cmdline.listen_backlog
+            max_workers = self.cmdline.threads
+            max_queue = self.cmdline.max_queue
+
+            def server_bind(self) -> None:
+                if not listener:
+                    if reuse_port:
+                        self.socket.setsockopt(socket.SOL_SOCKET,
+                                               socket.SO_REUSEPORT, 1)
+                    super().server_bind()
+                    return
+
+                # mirrors `WSGIServer.server_bind()` without binding
+                self.socket.close()
+                self.socket = listener
+                self.server_address = listener.getsockname()
+                self.server_name, self.server_port = 'localhost', 0
+                if listener.family != socket.AF_UNIX:
+                    host, self.server_port = self.server_address[:2]
+                    self.server_name = socket.getfqdn(host)
+                self.setup_environ()
+
+            def get_request(self) -> Tuple[socket.socket, Any]:
+                request, client_address = super().get_request()
+                # clients of unix sockets have no address,
+                # which `WSGIRequestHandler` needs
+                if self.address_family == socket.AF_UNIX:
+                    client_address = (self.server_address or 'unix', 0)
+                return request, client_address
 
         return ServerClass
 
+    def get_handler_class(self) -> Type['WSGIRequestHandler']:
+        """
+        Keep-alive connections would block a single-threaded server,
+        so they are only used with a pool of threads
+        :return:
+        """
+        if self.cmdline.threads:
+            return KeepAliveRequestHandler
+        return ExporterRequestHandler
+
+    def run_app(self, environ: Dict, snapshot: Optional[Snapshot] = None)\
+            -> Tuple[str, List[Tuple[str, str]], bytes]:
+        """
+        Call the WSGI app outside of a WSGI server
+        :param environ:
+        :param snapshot: snapshot for the collector to serve
+        :return: status, headers and body of the response
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'], response['headers'] = status, headers
+
+        with self.collector.pinned(snapshot):
+            body = b''.join(self.app(environ, start_response))
+        return response['status'], response['headers'], body
+
+    async def respond_async(self, environ: Dict) \
+            -> Tuple[str, List[Tuple[str, str]], bytes]:
+        """
+        Serve a request by the asyncio engine. Health checks are answered
+        right away, metrics are collected by the asyncio client and then
+        rendered by the WSGI app in a worker thread
+        :param environ:
+        :return: status, headers and body of the response
+        """
+        import asyncio
+
+        if environ['PATH_INFO'] == '/health':
+            return (self.collector.status,
+                    [('Content-Type', 'application/json')], b'{}')
+
+        snapshot = None
+        if environ['PATH_INFO'].startswith('/metric'):
+            params = parse_qs(environ['QUERY_STRING'])
+            sections = None
+            if 'name[]' in params:
+                sections = self.collector.sections_for(params['name[]'])
+            snapshot = await self.collector.get_snapshot_async(sections)
+
+        return await asyncio.get_event_loop().run_in_executor(
+            None, self.run_app, environ, snapshot)
+
+    async def handle_async(self, reader: 'asyncio.StreamReader',
+                           writer: 'asyncio.StreamWriter') -> None:
+        """
+        Serve HTTP/1.1 requests on a connection accepted
+        by the asyncio engine
+        :param reader:
+        :param writer:
+        :return:
+        """
+        import asyncio
+
+        server_name, server_port = 'localhost', 0
+        sockname = writer.get_extra_info('sockname')
+        # unix sockets are named by a path
+        if isinstance(sockname, tuple):
+            server_name, server_port = sockname[:2]
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(),
+                                                      KEEPALIVE_TIMEOUT)
+                if not request_line.strip():
+                    break
+                method, target, version = \
+                    request_line.decode('latin-1').split()
+                headers = await read_headers(reader)
+
+                path, _, query = target.partition('?')
+                environ = {
+                    'REQUEST_METHOD': method,
+                    'SCRIPT_NAME': '',
+                    'PATH_INFO': unquote(path),
+                    'QUERY_STRING': query,
+                    'SERVER_NAME': str(server_name),
+                    'SERVER_PORT': str(server_port),
+                    'SERVER_PROTOCOL': version,
+                    'wsgi.url_scheme': 'http',
+                }
+                for name, value in headers.items():
+                    environ[f'HTTP_{name.upper().replace("-", "_")}'] = value
+
+                try:
+                    status, response_headers, body = \
+                        await self.respond_async(environ)
+                except Exception:
+                    logger.exception(f'Serving {target} failed')
+                    status, response_headers, body = (
+                        '500 Internal Server Error',
+                        [('Content-Type', 'application/json')], b'{}')
+
+                close = version != 'HTTP/1.1' or \
+                    headers.get('connection', '').lower() == 'close'
+                head = [f'HTTP/1.1 {status}']
+                head.extend(f'{k}: {v}' for k, v in response_headers)
+                # 304 would describe the length of the omitted body
+                if not status.startswith('304'):
+                    head.append(f'Content-Length: {len(body)}')
+                if close:
+                    head.append('Connection: close')
+                writer.write('\r\n'.join(head).encode('latin-1')
+                             + b'\r\n\r\n' + body)
+                await writer.drain()
+                if close:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    def serve_async(self) -> None:
+        """
+        Run the asyncio engine until interrupted
+        :return:
+        """
+        import asyncio
+
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        if self.listener:
+            listen = asyncio.start_server(self.handle_async,
+                                          sock=self.listener,
+                                          backlog=self.cmdline.listen_backlog)
+        else:
+            listen = asyncio.start_server(
+                self.handle_async,
+                self.cmdline.bind or None,
+                self.cmdline.port,
+                family=getattr(socket, self.cmdline.address_family),
+                backlog=self.cmdline.listen_backlog,
+                reuse_port=bool(self.cmdline.workers) or None
+            )
+        server = loop.run_until_complete(listen)
+        try:
+            loop.run_forever()
+        finally:
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+            loop.close()
+
     @staticmethod
     def parse_args() -> argparse.Namespace:
         parser = argparse.ArgumentParser()
@@ -239,9 +2403,12 @@ class PatroniExporter:
                             help='Interface to listen at')
         parser.add_argument('-u', '--patroni-url',
                             dest='url',
-                            default=environ.get('PATRONI_EXPORTER_URL', 'http://localhost:8008/patroni'),
+                            default=environ.get('PATRONI_EXPORTER_URL'),
                             help='Patroni API url '
-                                 'where to send GET requests to')
+                                 'where to send GET requests to, '
+                                 'http://localhost:8008/patroni or '
+                                 'http://localhost:8008/cluster by default '
+                                 'depending on `--mode`')
         parser.add_argument('-d', '--debug',
                             dest='debug',
                             action='store_true',
@@ -266,8 +2433,104 @@ class PatroniExporter:
                                     TLS certificate, or a path
                                     to a CA bundle to use. 
                                     Defaults to ``true``""")
+        parser.add_argument('--poll-interval',
+                            dest='poll_interval',
+                            type=float,
+                            default=environ.get('PATRONI_EXPORTER_POLL_INTERVAL', 0),
+                            help='Poll Patroni API in the background every '
+                                 'N seconds and serve the last result. '
+                                 'Polls on every scrape when set to 0')
+        parser.add_argument('--pool-size',
+                            dest='pool_size',
+                            type=int,
+                            default=environ.get('PATRONI_EXPORTER_POOL_SIZE', 1),
+                            help='Number of persistent connections '
+                                 'kept open to the Patroni API')
+        parser.add_argument('--cache-ttl',
+                            dest='cache_ttl',
+                            type=float,
+                            default=environ.get('PATRONI_EXPORTER_CACHE_TTL', 0),
+                            help='Serve the last successful scrape '
+                                 'for N seconds without asking Patroni')
+        parser.add_argument('--cache-stale',
+                            dest='cache_stale',
+                            type=float,
+                            default=environ.get('PATRONI_EXPORTER_CACHE_STALE', 0),
+                            help='Serve an expired scrape for further '
+                                 'N seconds while it is being refreshed '
+                                 'in the background')
+        parser.add_argument('--engine',
+                            dest='engine',
+                            choices=('wsgi', 'asyncio'),
+                            default=environ.get('PATRONI_EXPORTER_ENGINE', 'wsgi'),
+                            help='Serve requests and talk to Patroni '
+                                 'by the blocking WSGI server or by '
+                                 'the non-blocking asyncio engine')
+        parser.add_argument('--threads',
+                            dest='threads',
+                            type=int,
+                            default=environ.get('PATRONI_EXPORTER_THREADS', 0),
+                            help='Serve requests by a pool of N threads '
+                                 'with HTTP/1.1 keep-alive. Requests are '
+                                 'served one at a time when set to 0')
+        parser.add_argument('--max-queue',
+                            dest='max_queue',
+                            type=int,
+                            default=environ.get('PATRONI_EXPORTER_MAX_QUEUE', 16),
+                            help='Number of connections waiting for a free '
+                                 'thread before new ones are refused')
+        parser.add_argument('--listen-backlog',
+                            dest='listen_backlog',
+                            type=int,
+                            default=environ.get('PATRONI_EXPORTER_LISTEN_BACKLOG', 5),
+                            help='Size of the listen queue of the socket')
+        parser.add_argument('--probe-concurrency',
+                            dest='probe_concurrency',
+                            type=int,
+                            default=environ.get('PATRONI_EXPORTER_PROBE_CONCURRENCY', 16),
+                            help='Maximum number of requests sent to Patroni '
+                                 'at once by the `/probe` endpoint')
+        parser.add_argument('-m', '--mode',
+                            dest='mode',
+                            choices=('node', 'cluster'),
+                            default=environ.get('PATRONI_EXPORTER_MODE', 'node'),
+                            help='Export the state of a single node from '
+                                 'the `/patroni` endpoint or of the whole '
+                                 'cluster from the `/cluster` endpoint')
+        parser.add_argument('--json-decoder',
+                            dest='json_decoder',
+                            choices=JSON_DECODERS,
+                            default=environ.get('PATRONI_EXPORTER_JSON_DECODER', JSON_DECODERS[0]),
+                            help='Library decoding the responses of Patroni. '
+                                 'Defaults to the fastest one installed')
+        parser.add_argument('--transport',
+                            dest='transport',
+                            choices=('requests', 'http'),
+                            default=environ.get('PATRONI_EXPORTER_TRANSPORT', 'requests'),
+                            help='Talk to Patroni by the requests library '
+                                 'or by a lightweight HTTP/1.1 client, '
+                                 'which is always used for `http+unix://` '
+                                 'URLs of Patroni behind a unix socket')
+        parser.add_argument('--unix-socket',
+                            dest='unix_socket',
+                            default=environ.get('PATRONI_EXPORTER_UNIX_SOCKET', ''),
+                            help='Listen at the unix socket of the given path '
+                                 'instead of `--bind` and `--port`')
+        parser.add_argument('--workers',
+                            dest='workers',
+                            type=int,
+                            default=environ.get('PATRONI_EXPORTER_WORKERS', 0),
+                            help='Serve requests by N processes listening '
+                                 'at the same port, while a single one polls '
+                                 'Patroni every `--poll-interval` seconds. '
+                                 'Requests are served by a single process '
+                                 'when set to 0')
 
         known, unknown = parser.parse_known_args()
+        if known.workers and not known.poll_interval:
+            parser.error('--workers requires --poll-interval')
+        if not known.url:
+            known.url = f'http://localhost:8008{MODE_PATHS[known.mode]}'
 
         # a hack because of the need to pass `-d` or '' via the systemd unit
         unknown = set(unknown) - {'', ' '}
@@ -283,6 +2546,8 @@ class PatroniExporter:
         :return:
         """
 
+        from prometheus_client.exposition import choose_encoder
+
         url = urlparse(request_uri(environ))
         if url.path == '/health':
             start_response(self.collector.status, [('Content-Type',
@@ -291,27 +2556,218 @@ class PatroniExporter:
 
         if url.path.startswith('/metric'):
             params = parse_qs(environ.get('QUERY_STRING', ''))
-            r = REGISTRY
+            names = params.get('name[]')
             encoder, content_type = choose_encoder(environ.get('HTTP_ACCEPT'))
-            if 'name[]' in params:
-                r = r.restricted_registry(params['name[]'])
-            output = encoder(r)
+
+            content_encoding = choose_content_encoding(
+                environ.get('HTTP_ACCEPT_ENCODING'))
+
+            # the metrics of Patroni only change with a new snapshot,
+            # which only needs to contain the requested metrics
+            sections = self.collector.sections_for(names) if names else None
+            snapshot = self.collector.current_snapshot(sections)
+            key = (content_type, frozenset(names or ()))
+            with self.collector.pinned(snapshot), \
+                    stage_timer('encode'):
+                rendered = self.render_cache.get(snapshot.generation, key)
+                if rendered is None:
+                    output = encoder(RegistryView(
+                        partial(self.collector.collect_snapshot, names)))
+                    # the volatile metrics follow in the same document
+                    if output.endswith(OPENMETRICS_EOF):
+                        output = output[:-len(OPENMETRICS_EOF)]
+                    rendered = RenderedMetrics(output, hashlib.blake2b(
+                        output, digest_size=16).hexdigest())
+                    self.render_cache.put(snapshot.generation, key, rendered)
+
+                # the weak ETag only covers the metrics of Patroni,
+                # the volatile ones are not worth a download of their own
+                etag = f'W/"{rendered.digest}-' \
+                       f'{content_encoding or "identity"}"'
+                headers = [(str('Content-type'), content_type),
+                           ('Vary', 'Accept-Encoding'),
+                           ('ETag', etag)]
+                if etag_matches(environ.get('HTTP_IF_NONE_MATCH'), etag):
+                    start_response('304 Not Modified', headers)
+                    return [b'']
+
+                # the metrics of the cache and of the exporter itself
+                # change with every scrape
+                volatile = encoder(RegistryView(
+                    partial(self.volatile_metrics, names)))
 
             status = str('200 OK')
-            headers = [(str('Content-type'), content_type)]
+            if content_encoding:
+                # the metrics of Patroni are compressed once per snapshot
+                compressed_key = key + (content_encoding,)
+                compress = self.render_cache.get(snapshot.generation,
+                                                 compressed_key)
+                if compress is None:
+                    compress = compress_prefix(content_encoding,
+                                               rendered.output)
+                    self.render_cache.put(snapshot.generation,
+                                          compressed_key, compress)
+                output = compress(volatile)
+                headers.append(('Content-Encoding', content_encoding))
+            else:
+                output = rendered.output + volatile
             start_response(status, headers)
             return [output]
 
+        if url.path == '/probe':
+            params = parse_qs(environ.get('QUERY_STRING', ''))
+            if 'target' not in params:
+                start_response('400 Bad Request',
+                               [('Content-Type', 'application/json')])
+                return [b'{"error": "missing target"}']
+            try:
+                target = self.probe_url(params['target'][0])
+            except ValueError:
+                start_response('400 Bad Request',
+                               [('Content-Type', 'application/json')])
+                return [b'{"error": "unsupported target scheme"}']
+            encoder, content_type = choose_encoder(environ.get('HTTP_ACCEPT'))
+            content_encoding = choose_content_encoding(
+                environ.get('HTTP_ACCEPT_ENCODING'))
+            output = self.probe(target, encoder)
+
+            headers = [('Content-type', content_type),
+                       ('Vary', 'Accept-Encoding')]
+            if content_encoding:
+                output = COMPRESSORS[content_encoding](output)
+                headers.append(('Content-Encoding', content_encoding))
+            start_response('200 OK', headers)
+            return [output]
+
         start_response('404 Not Found', [('Content-Type', 'application/json')])
         return [b'{}']
 
-    def __call__(self) -> None:
+    def volatile_metrics(self, names: Optional[List[str]] = None) \
+            -> 'Iterable[Metric]':
+        """
+        Collect the metrics changing with every scrape, those of the
+        snapshot cache and those of `REGISTRY` about the exporter itself
+        :param names: names of the samples to collect, None for all of them
+        :return:
+        """
+        from prometheus_client.core import REGISTRY
+
+        yield from self.collector.collect_stats(names)
+        # every scrape is served by any of the `--workers`, whose own
+        # counters and gauges would not be consistent between scrapes
+        if self.cmdline.workers:
+            return
+        registry = REGISTRY.restricted_registry(names) if names else REGISTRY
+        yield from registry.collect()
+
+    def create_listener(self) -> Optional[socket.socket]:
+        """
+        Create the socket to listen at before the server is started,
+        so that it is shared by `--workers`
+        :return: the socket passed by systemd, the `--unix-socket`,
+                 or None to listen at `--bind` and `--port`
+        """
+        listener = systemd_socket()
+        if listener:
+            logger.info(f'Listening at {listener.getsockname()} '
+                        f'passed by systemd')
+            return listener
+
+        path = self.cmdline.unix_socket
+        if not path:
+            return None
+        # left behind by a previous run
+        if os.path.exists(path) and stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(path)
+        self.owned_socket = path
+        listener.listen(self.cmdline.listen_backlog)
+        return listener
+
+    def serve(self) -> None:
+        """
+        Serve requests until interrupted
+        :return:
+        """
+        self.collector.start_polling()
+        if self.cmdline.engine == 'asyncio':
+            self.serve_async()
+            return
+
         httpd = make_server(self.cmdline.bind,
                             self.cmdline.port,
                             self.app,
-                            self.get_server_class())
+                            self.get_server_class(),
+                            self.get_handler_class())
         httpd.serve_forever()
 
+    def spawn_worker(self) -> int:
+        """
+        Fork a process serving requests
+        :return: pid of the worker
+        """
+        pid = os.fork()
+        if pid:
+            return pid
+        # SystemExit raised by the handler of the main process would be
+        # swallowed by wsgiref when it stopped the worker during a request
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            self.serve()
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        except Exception as e:
+            logger.error(f'Worker {os.getpid()} failed: {e}')
+        finally:
+            os._exit(0)
+
+    def serve_workers(self) -> None:
+        """
+        Serve requests by `--workers` processes sharing the port, while
+        this process scrapes Patroni every `--poll-interval` seconds,
+        publishes the responses to them and restarts the failed ones
+        :return:
+        """
+        def terminate(signum, frame):
+            raise SystemExit()
+
+        # the workers are stopped on the way out of the loop below
+        signal.signal(signal.SIGTERM, terminate)
+        # the workers start with a response to serve
+        self.collector.publish()
+        workers = {self.spawn_worker() for _ in range(self.cmdline.workers)}
+        try:
+            while True:
+                started = time.monotonic()
+                self.collector.publish()
+                while workers:
+                    pid, status = os.waitpid(-1, os.WNOHANG)
+                    if not pid:
+                        break
+                    logger.error(f'Worker {pid} exited with {status}, '
+                                 f'restarting it')
+                    workers.discard(pid)
+                    workers.add(self.spawn_worker())
+                elapsed = time.monotonic() - started
+                time.sleep(max(self.cmdline.poll_interval - elapsed, 0))
+        finally:
+            for pid in workers:
+                os.kill(pid, signal.SIGTERM)
+            for pid in workers:
+                os.waitpid(pid, 0)
+
+    def __call__(self) -> None:
+        self.listener = self.create_listener()
+        try:
+            if self.cmdline.workers:
+                self.serve_workers()
+            else:
+                self.serve()
+        finally:
+            if self.owned_socket and os.path.exists(self.owned_socket):
+                os.unlink(self.owned_socket)
+
 
 if __name__ == '__main__':
     pe = PatroniExporter()
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+from typing import Callable, Iterator
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the exporter is a script and the stub of Patroni lives in the benchmarks
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'benchmarks')]
+
+from bench_http import EXPORTER, free_port, wait_for  # noqa: E402
+from stub_patroni import StubServer, start_stub  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def stub() -> Iterator[StubServer]:
+    server = start_stub()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def exporter(stub: StubServer) -> Iterator[Callable[..., int]]:
+    """
+    Start the exporter scraping the stub with the given arguments
+    :return: function returning the port the exporter listens at
+    """
+    processes = []
+
+    def start(*args: str) -> int:
+        port = free_port()
+        url = f'http://127.0.0.1:{stub.server_address[1]}/patroni'
+        processes.append(subprocess.Popen(
+            [sys.executable, EXPORTER, '-u', url, '-p', str(port), *args],
+            stderr=subprocess.DEVNULL))
+        wait_for(port, '/health')
+        return port
+
+    yield start
+    for process in processes:
+        process.terminate()
+        process.wait()
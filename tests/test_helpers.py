@@ -0,0 +1,142 @@
+import gzip
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from patroni_exporter import (COMPRESSORS, PatroniCollector, WalHistory,
+                              choose_content_encoding, compress_prefix,
+                              etag_matches, parse_lsn)
+
+
+@pytest.mark.parametrize('timestring, expected', [
+    ('2024-01-10 09:14:52.109877+00:00',
+     datetime(2024, 1, 10, 9, 14, 52, 109877, timezone.utc)),
+    ('2024-01-10T09:14:52Z',
+     datetime(2024, 1, 10, 9, 14, 52, tzinfo=timezone.utc)),
+    ('2024-01-10 11:14:52.5+02:00',
+     datetime(2024, 1, 10, 9, 14, 52, 500000, timezone.utc)),
+    ('2024-01-10 04:14:52-0500',
+     datetime(2024, 1, 10, 9, 14, 52, tzinfo=timezone.utc)),
+    ('2024-01-10 09:14:52.1234567 +05:30',
+     datetime(2024, 1, 10, 9, 14, 52, 123456,
+              timezone(timedelta(hours=5, minutes=30)))),
+])
+def test_to_timestamp(timestring, expected):
+    assert PatroniCollector.to_timestamp(timestring) == expected.timestamp()
+
+
+def test_to_timestamp_local_time():
+    assert PatroniCollector.to_timestamp('2024-01-10 09:14:52') \
+        == datetime(2024, 1, 10, 9, 14, 52).timestamp()
+
+
+def test_to_timestamp_falls_back_to_dateutil():
+    assert PatroniCollector.to_timestamp('Wed, 10 Jan 2024 09:14:52 GMT') \
+        == datetime(2024, 1, 10, 9, 14, 52, tzinfo=timezone.utc).timestamp()
+
+
+@pytest.mark.parametrize('lsn, expected', [
+    ('0/3000060', 0x3000060),
+    ('1/0', 1 << 32),
+    ('A/FF', (10 << 32) + 255),
+    ('83894128', 83894128),
+    (83894128, 83894128),
+    ('0/xyz', None),
+    ('', None),
+    (None, None),
+    (True, None),
+    (1.5, None),
+])
+def test_parse_lsn(lsn, expected):
+    assert parse_lsn(lsn) == expected
+
+
+def history(*samples, capacity=64):
+    wal = WalHistory(('location',), capacity)
+    for when, value in samples:
+        wal.append(when, {'location': value})
+    return wal
+
+
+def test_rate():
+    assert history((0, 0), (10, 1000), (20, 3000)).rate('location') == 150
+
+
+def test_rate_needs_two_samples():
+    assert history().rate('location') is None
+    assert history((0, 1000)).rate('location') is None
+
+
+def test_rate_after_reset():
+    wal = history((0, 0), (10, 1000), (20, 100), (30, 300))
+    assert wal.rate('location') == 20
+
+
+def test_rate_just_after_reset():
+    assert history((0, 0), (10, 1000), (20, 100)).rate('location') is None
+
+
+def test_rate_within_window():
+    wal = history((0, 0), (100, 1000), (110, 2000))
+    assert wal.rate('location', window=60) == 100
+    # the previous sample is used even if it is older than the window
+    assert history((0, 0), (100, 1000)).rate('location', window=60) == 10
+
+
+def test_rate_of_unknown_values():
+    assert history((0, 0), (10, None)).rate('location') is None
+    assert history((0, 0), (10, None), (20, 100), (30, 300)) \
+        .rate('location') == 20
+
+
+def test_rate_in_full_ring_buffer():
+    wal = history(*((t, t * t) for t in range(5)), capacity=3)
+    assert wal.rate('location') == (16 - 4) / 2
+
+
+@pytest.mark.parametrize('accept_encoding, expected', [
+    (None, None),
+    ('', None),
+    ('gzip', 'gzip'),
+    ('deflate', 'deflate'),
+    ('br', None),
+    ('deflate, gzip', 'gzip'),
+    ('GZIP', 'gzip'),
+    ('gzip;q=0, deflate', 'deflate'),
+    ('gzip; q=0.5', 'gzip'),
+    ('gzip;q=x, deflate', 'deflate'),
+    ('*', next(iter(COMPRESSORS))),
+    ('identity', None),
+])
+def test_choose_content_encoding(accept_encoding, expected):
+    assert choose_content_encoding(accept_encoding) == expected
+
+
+@pytest.mark.parametrize('if_none_match, etag, expected', [
+    (None, '"a"', False),
+    ('', '"a"', False),
+    ('*', '"a"', True),
+    ('"a"', '"a"', True),
+    ('"b"', '"a"', False),
+    ('"b", "a"', '"a"', True),
+    ('W/"a"', '"a"', True),
+    ('"a"', 'W/"a"', True),
+    ('W/"a"', 'W/"a"', True),
+    (' W/"b" , W/"a" ', 'W/"a"', True),
+    ('W/"a-identity"', 'W/"a-gzip"', False),
+])
+def test_etag_matches(if_none_match, etag, expected):
+    assert etag_matches(if_none_match, etag) is expected
+
+
+@pytest.mark.parametrize('encoding, decompress', [
+    ('gzip', gzip.decompress),
+    ('deflate', zlib.decompress),
+])
+def test_compress_prefix(encoding, decompress):
+    prefix = b'patroni_xlog_location 83894128.0\n' * 100
+    compress = compress_prefix(encoding, prefix)
+    # the cached prefix is continued by every tail
+    for tail in (b'', b'process_open_fds 7.0\n', b'# EOF\n'):
+        assert decompress(compress(tail)) == prefix + tail
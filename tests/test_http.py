@@ -0,0 +1,122 @@
+import gzip
+import http.client
+import time
+from typing import Dict, Optional, Tuple
+
+import pytest
+
+ENGINES = {
+    'wsgi': (),
+    'threads': ('--threads', '4'),
+    'asyncio': ('--engine', 'asyncio'),
+    'workers': ('--workers', '2', '--poll-interval', '0.2'),
+}
+
+
+def get(port: int, path: str, headers: Optional[Dict[str, str]] = None) \
+        -> Tuple[int, Dict[str, str], bytes]:
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+    try:
+        connection.request('GET', path, headers=headers or {})
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def scrape(port: int, path: str = '/metrics', **headers: str) \
+        -> Tuple[int, Dict[str, str], bytes]:
+    """
+    Get the metrics once Patroni has been scraped twice, so that
+    the metrics derived from two scrapes are known
+    """
+    deadline = time.monotonic() + 10
+    while True:
+        response = get(port, path, headers)
+        body = response[2]
+        if response[1].get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        if b'patroni_wal_generated' in body:
+            return response
+        assert time.monotonic() < deadline, response
+        time.sleep(0.1)
+
+
+def sample_names(body: bytes):
+    return {line.split(b'{')[0].split()[0].decode()
+            for line in body.splitlines()
+            if line and not line.startswith(b'#')}
+
+
+@pytest.fixture(params=ENGINES)
+def port(request, exporter) -> int:
+    return exporter(*ENGINES[request.param])
+
+
+def test_metrics(port):
+    status, headers, body = scrape(port)
+    assert status == 200
+    assert headers['Content-type'].startswith('text/plain')
+    names = sample_names(body)
+    assert {'patroni_patroni_info', 'patroni_xlog_location',
+            'patroni_role_changes_total'} <= names
+
+
+def test_openmetrics(port):
+    status, headers, body = scrape(
+        port, Accept='application/openmetrics-text; version=1.0.0')
+    assert status == 200
+    assert headers['Content-type'].startswith('application/openmetrics-text')
+    # the cached and the volatile metrics make a single document
+    assert body.endswith(b'# EOF\n')
+    assert body.count(b'# EOF') == 1
+
+
+def test_name_filter(port):
+    scrape(port)
+    status, _, body = get(port, '/metrics?name[]=patroni_xlog_location'
+                                '&name[]=patroni_role_changes_total')
+    assert status == 200
+    assert sample_names(body) == {'patroni_xlog_location',
+                                  'patroni_role_changes_total'}
+
+
+def test_not_modified(port):
+    _, headers, body = scrape(port)
+    status, not_modified, body = get(port, '/metrics',
+                                     {'If-None-Match': headers['ETag']})
+    assert status == 304
+    assert body == b''
+    assert 'Content-Length' not in not_modified
+    assert not_modified['ETag'] == headers['ETag']
+
+
+def test_gzip(port):
+    _, plain, _ = scrape(port)
+    status, headers, body = scrape(port, **{'Accept-Encoding': 'gzip'})
+    assert status == 200
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['ETag'] != plain['ETag']
+    assert 'patroni_xlog_location' in sample_names(gzip.decompress(body))
+
+
+def test_health(port):
+    scrape(port)
+    assert get(port, '/health')[0] == 200
+
+
+def test_probe(exporter, stub):
+    port = exporter()
+    status, _, body = get(
+        port, f'/probe?target=127.0.0.1:{stub.server_address[1]}')
+    assert status == 200
+    assert {'probe_success', 'patroni_patroni_info'} <= sample_names(body)
+
+
+@pytest.mark.parametrize('target', [
+    'http%2Bunix%3A%2F%2F%252Frun%252Fpatroni.sock%2Fpatroni',
+    'file%3A%2F%2F%2Fetc%2Fpasswd',
+])
+def test_probe_rejects_scheme(exporter, target):
+    status, _, _ = get(exporter(), f'/probe?target={target}')
+    assert status == 400
@@ -0,0 +1,58 @@
+import threading
+
+import pytest
+
+from patroni_exporter import SharedScrape
+
+
+def test_read_written():
+    shared = SharedScrape(4096)
+    shared.write(200, b'{"role": "master"}', b'state')
+    assert shared.read() == (2, 200, b'{"role": "master"}', b'state')
+    shared.write(0, b'ConnectionError: refused')
+    assert shared.read() == (4, 0, b'ConnectionError: refused', b'')
+
+
+def test_read_before_write():
+    assert SharedScrape(4096).read() == (0, 0, b'', b'')
+
+
+def test_read_of_odd_sequence_times_out():
+    shared = SharedScrape(4096)
+    shared.write(200, b'{}')
+    # the writer died in the middle of writing
+    SharedScrape.HEADER.pack_into(shared.buffer, 0, 3, 0, 0, 0)
+    with pytest.raises(TimeoutError):
+        shared.read(timeout=0.05)
+
+
+def test_write_too_large():
+    shared = SharedScrape(64)
+    with pytest.raises(ValueError):
+        shared.write(200, b'x' * 64)
+    with pytest.raises(ValueError):
+        shared.write(200, b'x' * 32, b'y' * 32)
+
+
+def test_read_is_never_torn():
+    shared = SharedScrape(1 << 16)
+    stop = threading.Event()
+
+    def write():
+        size = 0
+        while not stop.is_set():
+            size = size % 30000 + 1
+            shared.write(200 + size % 2, b'b' * size, b's' * (size // 2))
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        for _ in range(2000):
+            sequence, status_code, body, state = shared.read()
+            assert sequence % 2 == 0
+            assert body == b'b' * len(body)
+            assert state == b's' * (len(body) // 2)
+            assert status_code == 200 + len(body) % 2 or not body
+    finally:
+        stop.set()
+        writer.join()